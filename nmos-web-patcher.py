@@ -55,7 +55,9 @@ def inject_version():
     return dict(app_version=__version__)
 
 async def graceful_shutdown(tasks):
+    from services import patch_engine
     print("\n[EXIT] Stopping, cleaning threads")
+    patch_engine.stop()
     for task in tasks:
         if isinstance(task, asyncio.Task):
             task.cancel()
@@ -66,11 +68,12 @@ async def graceful_shutdown(tasks):
     print("[EXIT] nmos-web-patcher has been stopped")
 
 async def run_all():
-    from services.cache import refresh_discovery, start_auto_refresh
+    from services.cache import start_background_discovery
+    from services import resource_store
     from protocols.bmdvideohub import VideohubEmulator
 
-    refresh_discovery()
-    start_auto_refresh()
+    resource_store.ensure_loaded()
+    start_background_discovery()
 
     builtins.main_event_loop = asyncio.get_running_loop()
 
@@ -2,10 +2,89 @@
 # by Arnaud Cresp - 2025
 
 import asyncio
+import time
 from __version__ import __version__
 from services.logical import load_logical_ids
-from services.cache import refresh_discovery, read_cache
-from services.patch_bus import emit_patch
+from services import resource_store
+from services.patch_bus import emit_patches, ESSENCES
+from services import salvos
+
+ROUTING_UPDATE = object()
+# Key of the virtual salvo output in routing deltas
+SALVO_OUTPUT = "salvo"
+
+class ClientConnection:
+    # One outbound queue and writer task per panel, a slow panel never holds up the others
+    def __init__(self, emulator, writer, limit, timeout):
+        self.emulator = emulator
+        self.writer = writer
+        self.addr = writer.get_extra_info('peername')
+        self.queue = asyncio.Queue()
+        self.limit = limit
+        self.timeout = timeout
+        self.routing_queued = False
+        self.routing_full = False
+        self.routing_dirty = set()
+        self.closed = False
+        self.task = asyncio.create_task(self.run())
+
+    def send(self, content, log=True):
+        if self.closed:
+            return
+        if self.queue.qsize() >= self.limit:
+            print(f"[BMD PROTOCOL] Client {self.addr} has {self.queue.qsize()} messages waiting, dropping it")
+            self.close()
+            return
+        if log and content is not ROUTING_UPDATE:
+            for line in content.strip().splitlines():
+                print(f"[BMD PROTOCOL] >> {line}")
+        self.queue.put_nowait(content)
+
+    def send_routing(self, outputs=None):
+        # outputs: logical output ids that changed, None for the whole table.
+        # Updates waiting for this client collapse into one, built when it is written
+        if outputs is None:
+            self.routing_full = True
+        else:
+            self.routing_dirty.update(outputs)
+        if not self.routing_queued:
+            self.routing_queued = True
+            self.send(ROUTING_UPDATE)
+
+    async def run(self):
+        try:
+            while True:
+                content = await self.queue.get()
+                if content is ROUTING_UPDATE:
+                    outputs = None if self.routing_full else self.routing_dirty
+                    self.routing_queued = False
+                    self.routing_full = False
+                    self.routing_dirty = set()
+                    content = self.emulator.output_routing(outputs)
+                    if content is None:
+                        continue
+                self.writer.write(content.encode() + b"\n\n")
+                await asyncio.wait_for(self.writer.drain(), self.timeout)
+        except asyncio.TimeoutError:
+            print(f"[BMD PROTOCOL] Client {self.addr} stopped reading for {self.timeout}s, dropping it")
+        except (ConnectionError, OSError) as e:
+            print(f"[BMD PROTOCOL] Client {self.addr} write failed: {e}")
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.emulator.clients.discard(self)
+        if asyncio.current_task() is not self.task:
+            self.task.cancel()
+        try:
+            self.writer.close()
+        except Exception as e:
+            print(f"[BMD PROTOCOL] Writer cleanup error: {e}")
 
 class VideohubEmulator:
     def __init__(self, host='0.0.0.0', port=9990):
@@ -21,10 +100,24 @@ class VideohubEmulator:
         self.input_id_to_index = {}
         self.output_id_to_index = {}
         self._running_task = None
+        self.loop = None
+        self.salvo_output = None
+        self.salvo_ids = []
+        self.salvo_input = None
+        self.dispatch_tasks = set()
+        self.dirty = set()
+        self.client_queue_limit = 64
+        self.client_write_timeout = 5
         self.load_labels()
 
     def load_labels(self):
-        logicals = load_logical_ids()
+        self.apply_labels(load_logical_ids())
+        self.salvo_input = None
+        self.routing = {}
+        self.dirty = set()
+
+    def apply_labels(self, logicals):
+        # Labels, index maps and reverse index from the logical groups, routing is left alone
         sources = logicals.get("sources", {})
         receivers = logicals.get("receivers", {})
 
@@ -36,10 +129,47 @@ class VideohubEmulator:
         self.input_id_to_index = {sid: idx for idx, sid in enumerate(self.input_index_map)}
         self.output_id_to_index = {rid: idx for idx, rid in enumerate(self.output_index_map)}
 
-        self.routing = {}
+        # Optional virtual output after the real ones: routing input N to it recalls the N-th salvo
+        from routes.settings import load_settings
+        self.salvo_ids = salvos.salvo_ids()
+        self.salvo_output = len(self.output_index_map) if load_settings().get("bmd_salvo_output", False) else None
+
+        self.build_reverse_index(sources, receivers)
+
+    def build_reverse_index(self, sources, receivers):
+        # receiver UUID -> logical receiver id, (essence, sender UUID) -> logical source ids
+        self.logical_receivers = {}
+        self.receiver_index = {}
+        for info in receivers.values():
+            if "id" not in info:
+                continue
+            uuids = {e: info[e] for e in ESSENCES if info.get(e)}
+            self.logical_receivers[info["id"]] = uuids
+            for uuid in uuids.values():
+                self.receiver_index[uuid] = info["id"]
+
+        self.logical_sources = {}
+        self.sender_index = {}
+        for info in sources.values():
+            if "id" not in info:
+                continue
+            uuids = {e: info[e] for e in ESSENCES if info.get(e)}
+            self.logical_sources[info["id"]] = uuids
+            for essence, uuid in uuids.items():
+                self.sender_index.setdefault((essence, uuid), []).append(info["id"])
+        self.source_order = {source_id: i for i, source_id in enumerate(self.logical_sources)}
 
     async def start(self):
-        await self.refresh_routing_from_nmos()
+        from routes.settings import load_settings
+        settings = load_settings()
+        # Room for a label reload (device, input and output labels, routing) plus a command reply
+        self.client_queue_limit = max(8, int(settings.get("bmd_client_queue", 64)))
+        self.client_write_timeout = float(settings.get("bmd_write_timeout", 5))
+
+        self.loop = asyncio.get_running_loop()
+        resource_store.subscribe(self.on_cache_change)
+        # Start from the loaded snapshot, background discovery updates routing through on_cache_change
+        self.sync_routing_from_cache()
         await self.broadcast_routing_update()
 
         self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
@@ -48,17 +178,16 @@ class VideohubEmulator:
         await self._running_task
 
     async def stop(self):
+        resource_store.unsubscribe(self.on_cache_change)
+        for task in list(self.dispatch_tasks):
+            task.cancel()
         if self.server:
             self.server.close()
             await self.server.wait_closed()
             print("[BMD PROTOCOL] Emulator stopped.")
 
         for client in list(self.clients):
-            try:
-                client.close()
-                await client.wait_closed()
-            except Exception as e:
-                print(f"[BMD PROTOCOL] Failed to close client: {e}")
+            client.close()
         self.clients.clear()
 
         if self._running_task:
@@ -72,20 +201,17 @@ class VideohubEmulator:
     async def handle_client(self, reader, writer):
         addr = writer.get_extra_info('peername')
         print(f"[BMD PROTOCOL] === New session from {addr} ===")
-        self.clients.add(writer)
-
-        try:
-            self.send(writer, self.preamble())
-            self.send(writer, self.device_info())
-            self.send(writer, self.input_labels())
-            self.send(writer, self.output_labels())
-            self.send(writer, self.output_routing())
-            await writer.drain()
-        except (ConnectionResetError, BrokenPipeError) as e:
-            print(f"[BMD PROTOCOL] Client disconnected prematurely: {e}")
-            return
-
-        await self.broadcast_routing_update()
+        client = ClientConnection(self, writer, self.client_queue_limit, self.client_write_timeout)
+        self.clients.add(client)
+
+        # Initial dump as one queued message, it must never count against the queue limit on its own
+        client.send("\n\n".join([
+            self.preamble(),
+            self.device_info(),
+            self.input_labels(),
+            self.output_labels(),
+            self.output_routing()
+        ]))
 
         buffer = []
         try:
@@ -96,25 +222,14 @@ class VideohubEmulator:
                 line = line.decode().strip()
                 print(f"[BMD PROTOCOL] << {line}")
                 if not line:
-                    await self.process_block(buffer, writer)
+                    await self.process_block(buffer, client)
                     buffer = []
                 else:
                     buffer.append(line)
+        except (ConnectionError, OSError) as e:
+            print(f"[BMD PROTOCOL] Client {addr} disconnected: {e}")
         finally:
-            self.clients.discard(writer)
-            try:
-                writer.close()
-                await writer.wait_closed()
-            except Exception as e:
-                print(f"[BMD PROTOCOL] Writer cleanup error: {e}")
-
-    def send(self, writer, content: str):
-        for line in content.strip().splitlines():
-            print(f"[BMD PROTOCOL] >> {line}")
-        try:
-            writer.write(content.encode() + b"\n\n")
-        except Exception as e:
-            print(f"[BMD PROTOCOL] Send failed: {e}")
+            client.close()
 
     def preamble(self):
         return "PROTOCOL PREAMBLE:\nVersion: 2.3"
@@ -126,42 +241,89 @@ class VideohubEmulator:
             "Model name: NMOS Web Patcher\n"
             f"Video inputs: {len(self.input_index_map)}\n"
             "Video processing units: 0\n"
-            f"Video outputs: {len(self.output_index_map)}\n"
+            f"Video outputs: {len(self.output_index_map) + (1 if self.salvo_output is not None else 0)}\n"
             "Video monitoring outputs: 0\n"
             "Serial ports: 0"
         )
 
     def input_labels(self):
-        lines = [f"{i} {self.inputs[logical_id]}" for i, logical_id in enumerate(self.input_index_map)]
+        lines = [f"{i} {label}" for i, label in enumerate(self.input_label_list())]
         return "INPUT LABELS:\n" + "\n".join(lines)
 
+    def input_label_list(self):
+        return [self.inputs[logical_id] for logical_id in self.input_index_map]
+
+    def output_label_list(self):
+        labels = [self.outputs[logical_id] for logical_id in self.output_index_map]
+        if self.salvo_output is not None:
+            labels.append("Salvo")
+        return labels
+
     def output_labels(self):
-        lines = [f"{i} {self.outputs[logical_id]}" for i, logical_id in enumerate(self.output_index_map)]
+        lines = [f"{i} {label}" for i, label in enumerate(self.output_label_list())]
         return "OUTPUT LABELS:\n" + "\n".join(lines)
 
-    def output_routing(self):
+    def set_route(self, receiver_id, sender_id):
+        # Every routing change goes through here so broadcasts only carry the outputs that moved
+        if self.routing.get(receiver_id) == sender_id:
+            return
+        if sender_id is None:
+            self.routing.pop(receiver_id, None)
+        else:
+            self.routing[receiver_id] = sender_id
+        self.dirty.add(receiver_id)
+
+    def output_routing(self, outputs=None):
+        # outputs: logical output ids to report, None for the whole table
+        if outputs is None:
+            targets = self.output_index_map
+        else:
+            targets = sorted((o for o in outputs if o in self.output_id_to_index), key=self.output_id_to_index.get)
+
         lines = []
-        for i, output_id in enumerate(self.output_index_map):
-            sender_id = self.routing.get(output_id)
-            input_idx = self.input_id_to_index.get(sender_id)
-            if sender_id is not None and input_idx is not None:
+        for output_id in targets:
+            i = self.output_id_to_index[output_id]
+            input_idx = self.input_id_to_index.get(self.routing.get(output_id))
+            if input_idx is not None:
                 lines.append(f"{i} {input_idx}")
-            else:
+            elif outputs is None:
                 print(f"[BMD PROTOCOL] No valid route for output {i} ({self.outputs.get(output_id)})")
+        if self.salvo_output is not None and self.salvo_input is not None and (outputs is None or SALVO_OUTPUT in outputs):
+            lines.append(f"{self.salvo_output} {self.salvo_input}")
+
+        if outputs is not None and not lines:
+            return None
         return "VIDEO OUTPUT ROUTING:\n" + "\n".join(lines)
 
-    async def broadcast_routing_update(self):
-        content = self.output_routing()
-        print(f"[BMD PROTOCOL] >> VIDEO OUTPUT ROUTING (broadcast):\n{content}")
+    def routing_lines(self):
+        # logical output -> (output index, input index) as currently reported to panels
+        lines = {}
+        for i, output_id in enumerate(self.output_index_map):
+            input_idx = self.input_id_to_index.get(self.routing.get(output_id))
+            if input_idx is not None:
+                lines[output_id] = (i, input_idx)
+        if self.salvo_output is not None and self.salvo_input is not None:
+            lines[SALVO_OUTPUT] = (self.salvo_output, self.salvo_input)
+        return lines
+
+    def broadcast(self, content):
+        for line in content.strip().splitlines():
+            print(f"[BMD PROTOCOL] >> {line} (broadcast)")
         for client in list(self.clients):
-            try:
-                self.send(client, content)
-                await client.drain()
-            except Exception as e:
-                print(f"[BMD PROTOCOL] Failed to notify client: {e}")
-                self.clients.discard(client)
+            client.send(content, log=False)
+
+    async def broadcast_routing_update(self, full=False):
+        # Sends the outputs changed since the last broadcast, or the whole table when full is set.
+        # Only queues the update, each client's writer task sends it at its own pace
+        outputs = None if full else self.dirty
+        self.dirty = set()
+        if outputs is not None and not outputs:
+            return
+        print(f"[BMD PROTOCOL] >> VIDEO OUTPUT ROUTING to {len(self.clients)} client(s): {'full table' if full else f'{len(outputs)} output(s)'}")
+        for client in list(self.clients):
+            client.send_routing(outputs)
 
-    async def process_block(self, lines, writer):
+    async def process_block(self, lines, client):
         if not lines:
             return
 
@@ -169,8 +331,7 @@ class VideohubEmulator:
         body = lines[1:]
 
         if header == "PING:":
-            self.send(writer, "ACK")
-            await writer.drain()
+            client.send("ACK")
             return
 
         if header.endswith(":") and not body:
@@ -180,34 +341,73 @@ class VideohubEmulator:
                 "VIDEO OUTPUT ROUTING": self.output_routing,
                 "VIDEOHUB DEVICE": self.device_info,
             }
-            if header in known:
-                self.send(writer, "ACK")
-                self.send(writer, known[header]())
-                await writer.drain()
+            if header.rstrip(":") in known:
+                client.send("ACK")
+                client.send(known[header.rstrip(":")]())
                 return
 
         if header == "VIDEO OUTPUT ROUTING:":
             changed = []
+            routes = []
+            previous = {}
+            salvo_input = None
             for line in body:
                 try:
                     out_idx, in_idx = map(int, line.split())
+                    if out_idx == self.salvo_output:
+                        salvo_input = in_idx
+                        changed.append(f"{out_idx} {in_idx}")
+                        continue
                     receiver_id = self.output_index_map[out_idx]
                     sender_id = self.input_index_map[in_idx]
-                    self.routing[receiver_id] = sender_id
-                    await emit_patch(sender_id, receiver_id, origin="BMD")
+                    previous.setdefault(receiver_id, self.routing.get(receiver_id))
+                    self.set_route(receiver_id, sender_id)
+                    routes.append((sender_id, receiver_id))
                     changed.append(f"{out_idx} {in_idx}")
-                    print(f"[BMD PROTOCOL] Patched output {out_idx} ← input {in_idx} (logical {receiver_id} ← {sender_id})")
                 except Exception as e:
                     print(f"[BMD PROTOCOL] Failed to parse line '{line}': {e}")
 
-            self.send(writer, "ACK")
+            # ACK right away, the patches run in the background and a broadcast confirms them
+            client.send("ACK")
             if changed:
-                self.send(writer, "VIDEO OUTPUT ROUTING:\n" + "\n".join(changed))
-            await writer.drain()
-            await self.broadcast_routing_update()
+                client.send("VIDEO OUTPUT ROUTING:\n" + "\n".join(changed))
+
+            if routes or salvo_input is not None:
+                task = asyncio.create_task(self.dispatch_block(routes, previous, salvo_input))
+                self.dispatch_tasks.add(task)
+                task.add_done_callback(self.dispatch_tasks.discard)
         else:
-            self.send(writer, "NAK")
-            await writer.drain()
+            client.send("NAK")
+
+    async def dispatch_block(self, routes, previous, salvo_input):
+        # All lines of the block are patched as one concurrent batch
+        started = time.monotonic()
+
+        async def patch_routes():
+            try:
+                patched = await emit_patches(routes, origin="BMD")
+            except Exception as e:
+                print(f"[BMD PROTOCOL] Failed to patch routing block: {e}")
+                patched = [{} for _ in routes]
+
+            for (sender_id, receiver_id), result in zip(routes, patched):
+                out_idx = self.output_id_to_index.get(receiver_id)
+                if any(info.get("status") == "success" for info in result.values()):
+                    print(f"[BMD PROTOCOL] Patched output {out_idx} ← logical {sender_id} (logical {receiver_id})")
+                elif self.routing.get(receiver_id) == sender_id:
+                    # Nothing was patched and no newer route replaced it: report the old route again
+                    print(f"[BMD PROTOCOL] Output {out_idx} could not be patched, restoring previous route")
+                    self.set_route(receiver_id, previous.get(receiver_id))
+
+        jobs = []
+        if routes:
+            jobs.append(patch_routes())
+        if salvo_input is not None:
+            jobs.append(self.recall_salvo(salvo_input))
+        await asyncio.gather(*jobs)
+
+        print(f"[BMD PROTOCOL] Routing block done in {(time.monotonic() - started) * 1000:.1f} ms")
+        await self.broadcast_routing_update()
 
     async def set_routing(self, sender_id, receiver_id, origin="external", force_broadcast=False):
         current = self.routing.get(receiver_id)
@@ -215,58 +415,147 @@ class VideohubEmulator:
             print(f"[BMD PROTOCOL] No update needed from {origin}: {receiver_id} already routed to {sender_id}")
             return
 
-        self.routing[receiver_id] = sender_id
+        self.set_route(receiver_id, sender_id)
+        self.dirty.add(receiver_id)
         print(f"[BMD PROTOCOL] Update from {origin}: {receiver_id} ← {sender_id} (was {current})")
         await self.broadcast_routing_update()
 
-    async def reload_and_broadcast(self):
-        self.load_labels()
-        await self.refresh_routing_from_nmos()
+    async def set_routes(self, routes, origin="external"):
+        # Several routes at once (salvos), a single broadcast
+        for sender_id, receiver_id in routes:
+            self.set_route(receiver_id, sender_id)
+        print(f"[BMD PROTOCOL] Update from {origin}: {len(routes)} route(s)")
         await self.broadcast_routing_update()
-        print("[BMD PROTOCOL] Reloaded logical labels and broadcasted update.")
 
-    async def refresh_routing_from_nmos(self):
-        try:
-            await asyncio.to_thread(refresh_discovery)
-            cache = read_cache()
-            logicals = load_logical_ids()
-            receivers_cache = cache.get("receivers", [])
-            matched = 0
+    async def recall_salvo(self, in_idx):
+        if in_idx >= len(self.salvo_ids):
+            print(f"[BMD PROTOCOL] No salvo for input {in_idx}")
+            return False
+
+        name, salvo = salvos.find_salvo(self.salvo_ids[in_idx])
+        if not salvo:
+            return False
 
-            for receiver_name, receiver_info in logicals.get("receivers", {}).items():
-                receiver_id = receiver_info.get("id")
-                found = False
-                for source_name, source_info in logicals.get("sources", {}).items():
-                    sender_match = True
-                    for essence in ["video", "audio", "data"]:
-                        sender_id = source_info.get(essence)
-                        receiver_uuid = receiver_info.get(essence)
-
-                        if not sender_id or not receiver_uuid:
-                            continue
-
-                        receiver_obj = next((r for r in receivers_cache if r.get("id") == receiver_uuid), None)
-                        if not receiver_obj:
-                            print(f"[BMD MATCH] Receiver {receiver_name} missing from cache (UUID={receiver_uuid})")
-                            sender_match = False
-                            break
-
-                        actual_sender = receiver_obj.get("subscription", {}).get("sender_id")
-                        if actual_sender != sender_id:
-                            print(f"[BMD MATCH] Mismatch for {receiver_name}: expected {sender_id}, got {actual_sender}")
-                            sender_match = False
-                            break
-
-                    if sender_match:
-                        self.routing[receiver_id] = source_info.get("id")
-                        print(f"[BMD SYNC] {receiver_name} ← {source_name}")
-                        matched += 1
-                        found = True
+        print(f"[BMD PROTOCOL] Recalling salvo {name}")
+        try:
+            outcome = await salvos.recall_salvo_async(salvo)
+        except Exception as e:
+            print(f"[BMD PROTOCOL] Salvo {name} failed: {e}")
+            return False
+
+        for sender_id, receiver_id in salvos.applied_routes(outcome):
+            self.set_route(receiver_id, sender_id)
+        self.salvo_input = in_idx
+        self.dirty.add(SALVO_OUTPUT)
+        print(f"[BMD PROTOCOL] Salvo {name}: {len(outcome['results'])} route(s) in {outcome['duration_ms']} ms")
+        return True
+
+    async def apply_logical_update(self, logicals):
+        # Logical groups edited in Settings: labels and indexes are rebuilt in memory from the new data,
+        # panels get only the label and routing lines that moved, and only groups whose UUIDs changed are reconciled
+        old_inputs = self.input_label_list()
+        old_outputs = self.output_label_list()
+        old_receivers = self.logical_receivers
+        old_sources = self.logical_sources
+        old_lines = self.routing_lines()
+        pending = set(self.dirty)
+
+        self.apply_labels(logicals)
+
+        # Routes of deleted groups go away
+        for receiver_id, source_id in list(self.routing.items()):
+            if receiver_id not in self.logical_receivers or source_id not in self.logical_sources:
+                del self.routing[receiver_id]
+
+        affected = {rid for rid, uuids in self.logical_receivers.items() if old_receivers.get(rid) != uuids}
+        changed_sources = {sid for sid, uuids in self.logical_sources.items() if old_sources.get(sid) != uuids}
+        if changed_sources:
+            # Receivers routed to a changed source, or now subscribed to one of its senders
+            senders = {uuid for sid in changed_sources for uuid in self.logical_sources[sid].values()}
+            for receiver_id, uuids in self.logical_receivers.items():
+                if self.routing.get(receiver_id) in changed_sources:
+                    affected.add(receiver_id)
+                    continue
+                for uuid in uuids.values():
+                    receiver = resource_store.get("receivers", uuid)
+                    if receiver and receiver.sender_id in senders:
+                        affected.add(receiver_id)
                         break
+        if affected:
+            self.sync_routing_from_cache(affected)
+
+        new_inputs = self.input_label_list()
+        new_outputs = self.output_label_list()
+        if len(new_inputs) != len(old_inputs) or len(new_outputs) != len(old_outputs):
+            self.broadcast(self.device_info())
+
+        input_lines = [f"{i} {label}" for i, label in enumerate(new_inputs) if i >= len(old_inputs) or old_inputs[i] != label]
+        if input_lines:
+            self.broadcast("INPUT LABELS:\n" + "\n".join(input_lines))
+        output_lines = [f"{i} {label}" for i, label in enumerate(new_outputs) if i >= len(old_outputs) or old_outputs[i] != label]
+        if output_lines:
+            self.broadcast("OUTPUT LABELS:\n" + "\n".join(output_lines))
+
+        # Only lines that differ from what panels last saw go out, index shifts included
+        lines = self.routing_lines()
+        self.dirty = {output_id for output_id in pending if output_id in lines}
+        self.dirty.update(output_id for output_id, line in lines.items() if old_lines.get(output_id) != line)
+        await self.broadcast_routing_update()
+        print(f"[BMD PROTOCOL] Logical groups updated: {len(input_lines)} input and {len(output_lines)} output label(s) changed, {len(affected)} group(s) reconciled")
+
+    def on_cache_change(self, diff):
+        changes = diff.get("receivers", {})
+        changed = set(changes.get("added", [])) | set(changes.get("removed", [])) | set(changes.get("modified", []))
+        if not changed or not self.loop:
+            return
 
-                if not found:
-                    print(f"[BMD SYNC] No matching source found for receiver: {receiver_name}")
+        affected = {self.receiver_index[uuid] for uuid in changed if uuid in self.receiver_index}
+        if affected:
+            asyncio.run_coroutine_threadsafe(self.apply_cache_change(affected), self.loop)
 
-            print(f"[BMD PROTOCOL] Routing sync completed: {matched} logical group(s) matched.")
+    async def apply_cache_change(self, receiver_ids=None):
+        self.sync_routing_from_cache(receiver_ids)
+        await self.broadcast_routing_update()
+
+    def match_source(self, receiver_uuids):
+        # Logical source whose senders are the ones this logical receiver is subscribed to
+        actual = {}
+        candidates = set()
+        for essence, uuid in receiver_uuids.items():
+            receiver = resource_store.get("receivers", uuid)
+            actual[essence] = receiver.sender_id if receiver else None
+            candidates.update(self.sender_index.get((essence, actual[essence]), ()))
+
+        # Same precedence as data_logical.json order when several sources match
+        for source_id in sorted(candidates, key=self.source_order.get):
+            source = self.logical_sources[source_id]
+            if all(actual[e] == source[e] for e in receiver_uuids if e in source):
+                return source_id
+        return None
+
+    def sync_routing_from_cache(self, receiver_ids=None):
+        # receiver_ids: logical receivers to reconcile, None for all of them
+        try:
+            started = time.monotonic()
+            targets = self.logical_receivers if receiver_ids is None else receiver_ids
+            matched = 0
+            unmatched = []
+
+            for receiver_id in targets:
+                receiver_uuids = self.logical_receivers.get(receiver_id)
+                if receiver_uuids is None:
+                    continue
+                source_id = self.match_source(receiver_uuids)
+                if source_id is None:
+                    # Subscribed to something no logical source maps, the old route no longer holds
+                    self.set_route(receiver_id, None)
+                    unmatched.append(self.outputs.get(receiver_id, receiver_id))
+                    continue
+                self.set_route(receiver_id, source_id)
+                matched += 1
+
+            if unmatched:
+                print(f"[BMD SYNC] No matching source found for: {', '.join(map(str, unmatched))}")
+            print(f"[BMD PROTOCOL] Routing sync completed: {matched}/{len(targets)} logical group(s) matched in {(time.monotonic() - started) * 1000:.1f} ms")
         except Exception as e:
-            print(f"[BMD PROTOCOL] Error syncing NMOS routing: {e}")
\ No newline at end of file
+            print(f"[BMD PROTOCOL] Error syncing NMOS routing: {e}")
@@ -3,8 +3,9 @@
 
 from flask import Blueprint, jsonify, request
 from services.logical import get_logical_pair
-from services.nmos_connection import change_source
+from services.patch_bus import patch_logical_groups
 import json
+import time
 from functools import wraps
 import asyncio
 import builtins
@@ -36,7 +37,6 @@ def rest_api_enabled_only():
 @rest_api_enabled_only()
 def take_logical():
     from services.logical import load_logical_ids
-    from services.data_loader import load_nodes
 
     src_id = request.args.get("src")
     dest_id = request.args.get("dest")
@@ -49,39 +49,12 @@ def take_logical():
         return jsonify({"status": "error", "message": "Invalid src or dest ID"}), 404
 
     logical = load_logical_ids()
-    nodes = load_nodes()
 
     # Find logical names
     source_name = next((name for name, val in logical.get("sources", {}).items() if val.get("id") == int(src_id)), None)
     destination_name = next((name for name, val in logical.get("receivers", {}).items() if val.get("id") == int(dest_id)), None)
 
-    patched = {}
-
-    for essence in ["video", "audio", "data"]:
-        sender = src.get(essence)
-        receiver = dest.get(essence)
-
-        if sender and receiver:
-            try:
-                patch_result = change_source(nodes, receiver, sender)
-                patched[essence] = {
-                    "status": patch_result.get("status"),
-                    "sender": sender,
-                    "receiver": receiver,
-                    "message": patch_result.get("message", "")
-                }
-            except Exception as e:
-                patched[essence] = {
-                    "status": "error",
-                    "sender": sender,
-                    "receiver": receiver,
-                    "message": str(e)
-                }
-        else:
-            patched[essence] = {
-                "status": "skipped",
-                "reason": "missing sender or receiver"
-            }
+    patched = patch_logical_groups([(src, dest)])[0]
 
     # PatchCode Generation
     def essence_status_bit(info):
@@ -93,10 +66,14 @@ def take_logical():
         essence_status_bit(patched.get("data", {}))
     )
 
-    # Update BMD Ethernet Protocol status
+    # Update BMD Ethernet Protocol status, unless a newer take replaced this one
+    sent = [info for info in patched.values() if info.get("sender")]
+    superseded = bool(sent) and all(info.get("status") == "superseded" for info in sent)
     try:
         emulator = getattr(builtins, "emulator_instance", None)
-        if emulator:
+        if superseded:
+            print(f"[RESTAPI] Take {dest_id} ← {src_id} superseded, BMD not notified")
+        elif emulator:
             sender_id = int(src_id)
             receiver_id = int(dest_id)
             loop = getattr(builtins, "main_event_loop", None)
@@ -155,8 +132,7 @@ def list_logical_groups():
 @rest_api_enabled_only()
 def disconnect_logical():
     from services.logical import load_logical_ids
-    from services.data_loader import load_nodes
-    from services.nmos_connection import disconnect_receiver
+    from services import patch_queue
 
     dest_id = request.args.get("dest")
     if not dest_id:
@@ -175,25 +151,24 @@ def disconnect_logical():
         return jsonify({"status": "error", "message": "Receiver group not found"}), 404
 
     dest = logical["receivers"][dest_name]
-    nodes = load_nodes()
     result = {}
 
+    essences = [e for e in ["video", "audio", "data"] if dest.get(e)]
+    try:
+        futures = patch_queue.submit([(dest[e], None) for e in essences])
+        outcomes = [future.result() for future in futures]
+    except Exception as e:
+        outcomes = [{"status": "error", "message": str(e)}] * len(essences)
+
     for essence in ["video", "audio", "data"]:
         receiver_id = dest.get(essence)
         if receiver_id:
-            try:
-                r = disconnect_receiver(nodes, receiver_id)
-                result[essence] = {
-                    "status": r.get("status"),
-                    "receiver": receiver_id,
-                    "message": r.get("message", "")
-                }
-            except Exception as e:
-                result[essence] = {
-                    "status": "error",
-                    "receiver": receiver_id,
-                    "message": str(e)
-                }
+            r = outcomes[essences.index(essence)]
+            result[essence] = {
+                "status": r.get("status"),
+                "receiver": receiver_id,
+                "message": r.get("message", "")
+            }
         else:
             result[essence] = {
                 "status": "skipped",
@@ -211,8 +186,6 @@ def disconnect_logical():
 @rest_api_enabled_only()
 def take_many():
     from services.logical import load_logical_ids
-    from services.data_loader import load_nodes
-    from services.nmos_connection import change_source
 
     src_id = request.args.get("src")
     dest_ids = request.args.get("dest")
@@ -227,7 +200,6 @@ def take_many():
         return jsonify({"status": "error", "message": "Invalid ID format"}), 400
 
     logical = load_logical_ids()
-    nodes = load_nodes()
 
     src_name = next((name for name, val in logical["sources"].items() if val.get("id") == src_id), None)
     src = logical["sources"].get(src_name) if src_name else None
@@ -236,11 +208,20 @@ def take_many():
         return jsonify({"status": "error", "message": "Invalid source ID"}), 404
 
     responses = []
+    destinations = []
 
     for dest_id in dest_ids:
         dest_name = next((name for name, val in logical["receivers"].items() if val.get("id") == dest_id), None)
         dest = logical["receivers"].get(dest_name) if dest_name else None
+        destinations.append((dest_id, dest_name, dest))
 
+    # Every leg of every valid destination goes out in one batch
+    started = time.monotonic()
+    valid = [dest for _, _, dest in destinations if dest]
+    patched_all = iter(patch_logical_groups([(src, dest) for dest in valid]))
+    duration_ms = round((time.monotonic() - started) * 1000, 1)
+
+    for dest_id, dest_name, dest in destinations:
         if not dest:
             responses.append({
                 "dest_id": dest_id,
@@ -250,32 +231,7 @@ def take_many():
             })
             continue
 
-        patched = {}
-        for essence in ["video", "audio", "data"]:
-            sender = src.get(essence)
-            receiver = dest.get(essence)
-
-            if sender and receiver:
-                try:
-                    patch_result = change_source(nodes, receiver, sender)
-                    patched[essence] = {
-                        "status": patch_result.get("status"),
-                        "sender": sender,
-                        "receiver": receiver,
-                        "message": patch_result.get("message", "")
-                    }
-                except Exception as e:
-                    patched[essence] = {
-                        "status": "error",
-                        "sender": sender,
-                        "receiver": receiver,
-                        "message": str(e)
-                    }
-            else:
-                patched[essence] = {
-                    "status": "skipped",
-                    "reason": "missing sender or receiver"
-                }
+        patched = next(patched_all)
 
         def essence_status_bit(info):
             return "1" if info.get("status") in ["success", "patched"] else "0"
@@ -297,16 +253,78 @@ def take_many():
     return jsonify({
         "status": "ok",
         "source_name": src_name,
+        "duration_ms": duration_ms,
         "results": responses
     })
 
+# API Salvo List Function
+@restapi_bp.route("/api/salvos", methods=["GET"])
+@rest_api_enabled_only()
+def list_salvos():
+    from services.salvos import load_salvos
+
+    salvos = [
+        {"id": val.get("id"), "name": name, "routes": len(val.get("routes", []))}
+        for name, val in load_salvos().items()
+    ]
+    return jsonify({"status": "ok", "salvos": sorted(salvos, key=lambda x: x["id"] or 0)})
+
+# API Salvo Recall Function
+@restapi_bp.route("/api/salvo", methods=["GET"])
+@rest_api_enabled_only()
+def recall_salvo():
+    from services.salvos import find_salvo, recall_salvo, applied_routes
+
+    salvo_id = request.args.get("id")
+    name = request.args.get("name")
+    if not salvo_id and not name:
+        return jsonify({"status": "error", "message": "Missing id or name"}), 400
+
+    salvo_name, salvo = find_salvo(salvo_id, name)
+    if not salvo:
+        return jsonify({"status": "error", "message": "Salvo not found"}), 404
+
+    outcome = recall_salvo(salvo)
+
+    # Update BMD Ethernet Protocol status, one broadcast for the whole salvo
+    try:
+        emulator = getattr(builtins, "emulator_instance", None)
+        loop = getattr(builtins, "main_event_loop", None)
+        if emulator and loop:
+            asyncio.run_coroutine_threadsafe(
+                emulator.set_routes(applied_routes(outcome), origin="REST"),
+                loop
+            ).result()
+    except Exception as e:
+        print(f"[RESTAPI] Failed to notify BMD Emulator: {e}")
+
+    return jsonify({
+        "status": "ok",
+        "salvo_id": salvo.get("id"),
+        "salvo_name": salvo_name,
+        **outcome
+    })
+
+# API Cache Changes Function
+@restapi_bp.route("/api/changes", methods=["GET"])
+@rest_api_enabled_only()
+def cache_changes():
+    from services import resource_store
+
+    try:
+        since = int(request.args.get("since", -1))
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid since generation"}), 400
+
+    return jsonify({"status": "ok", **resource_store.changes_since(since)})
+
 # API Dest Status Function
 @restapi_bp.route("/api/status", methods=["GET"])
 @rest_api_enabled_only()
 def status_logical():
-    import requests
-    from services.cache import read_cache
+    from services import resource_store, http_client
     from services.logical import load_logical_ids
+    from services.nmos_connection import connection_url
 
     dest_id = request.args.get("dest")
     if not dest_id:
@@ -318,8 +336,6 @@ def status_logical():
         return jsonify({"status": "error", "message": "Invalid dest ID"}), 400
 
     logicals = load_logical_ids()
-    cache = read_cache()
-    receivers = cache.get("receivers", [])
 
     receiver_name = None
     logical_receiver = None
@@ -339,16 +355,14 @@ def status_logical():
         if not receiver_uuid:
             continue
 
-        receiver = next((r for r in receivers if r.get("id") == receiver_uuid), None)
+        receiver = resource_store.get("receivers", receiver_uuid)
         if not receiver:
             continue
 
-        node_url = receiver.get('node_url')
-        version = receiver.get('versions', {}).get('connection', 'v1.1')
-        url = f"{node_url}/connection/{version}/single/receivers/{receiver_uuid}/active/"
+        url = connection_url(receiver, f"single/receivers/{receiver_uuid}/active/")
 
         try:
-            r = requests.get(url, timeout=2)
+            r = http_client.get(url)
             if r.status_code == 200:
                 sender_id = r.json().get("sender_id")
                 if sender_id:
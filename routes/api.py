@@ -2,14 +2,11 @@
 # by Arnaud Cresp - 2025
 
 from flask import Blueprint, request, jsonify
-from services.data_loader import load_nodes
-from services.nmos_connection import change_source, disconnect_receiver
+from services import patch_queue
 from services.cache import refresh_discovery
 
 api_bp = Blueprint('api', __name__)
 
-refresh_discovery()
-
 @api_bp.route('/refresh_cache')
 def api_refresh_cache():
     try:
@@ -19,6 +16,38 @@ def api_refresh_cache():
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+@api_bp.route('/ready')
+def api_ready():
+    from services import resource_store, node_health, sdp_cache
+    from services.cache import discovery_progress
+    from services.node_scheduler import get_scheduler
+    from services.nmos_connection import sender_stats
+
+    snapshot = resource_store.current()
+    ready = discovery_progress["completed_runs"] > 0
+    return jsonify({
+        "status": "success",
+        "ready": ready,
+        "generation": snapshot["generation"],
+        "receivers": len(snapshot["receivers"]),
+        "sources": len(snapshot["sources"]),
+        "discovery": dict(discovery_progress),
+        "nodes": node_health.get_states(),
+        "polling": get_scheduler().get_node_states() if get_scheduler() else {},
+        "patch_queue": patch_queue.queue_state(),
+        "sdp_cache": sdp_cache.cache_state(),
+        "sender_activation": dict(sender_stats)
+    }), (200 if ready else 503)
+
+@api_bp.route('/cache_changes')
+def api_cache_changes():
+    from services import resource_store
+    try:
+        since = int(request.args.get('since', -1))
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid generation"}), 400
+    return jsonify({"status": "success", **resource_store.changes_since(since)})
+
 @api_bp.route('/change_source', methods=['POST'])
 def api_change_source():
     data = request.json
@@ -28,8 +57,7 @@ def api_change_source():
     if not receiver_id or not sender_id:
         return jsonify({"status": "error", "message": "Missing receiver or sender ID"}), 400
 
-    nodes = load_nodes()
-    result = change_source(nodes, receiver_id, sender_id)
+    result = patch_queue.submit([(receiver_id, sender_id)])[0].result()
     return jsonify(result), (200 if result["status"] == "success" else result.get("code", 500))
 
 @api_bp.route('/disconnect_receiver', methods=['POST'])
@@ -40,34 +68,41 @@ def api_disconnect_receiver():
     if not receiver_id:
         return jsonify({"status": "error", "message": "Missing receiver ID"}), 400
 
-    nodes = load_nodes()
-    result = disconnect_receiver(nodes, receiver_id)
+    result = patch_queue.submit([(receiver_id, None)])[0].result()
     return jsonify(result), (200 if result["status"] == "success" else result.get("code", 500))
 
+@api_bp.route('/resource/<resource_id>')
+def get_resource_payload(resource_id):
+    from services import resource_store
+    from services.nmos_discovery import fetch_resource_payload
+
+    resource = resource_store.get("receivers", resource_id) or resource_store.get("sources", resource_id)
+    if not resource:
+        return jsonify({"status": "error", "message": "Resource not found"}), 404
+
+    try:
+        return jsonify({"status": "success", "resource": resource.to_dict(), "payload": fetch_resource_payload(resource)})
+    except Exception as e:
+        print(f"[ERROR] Failed to fetch payload for {resource_id}: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 502
+
 @api_bp.route('/get_current_sender/<receiver_id>')
 def get_current_sender(receiver_id):
-    import requests
-    from services.cache import read_cache
+    from services import resource_store, http_client
+    from services.nmos_connection import connection_url
 
-    cache = read_cache()
-    receivers = cache.get("receivers", [])
-    sources = cache.get("sources", [])
-
-    receiver = next((r for r in receivers if r.get("id") == receiver_id), None)
+    receiver = resource_store.get("receivers", receiver_id)
     if not receiver:
         print(f"[WARNING] Receiver with ID {receiver_id} not found in cache")
         return jsonify({"status": "error", "message": "Receiver not found"})
 
-    node_url = receiver.get('node_url')
-    version = receiver.get('versions', {}).get('connection', 'v1.1')
-
-    if not node_url:
+    if not receiver.node_url:
         print(f"[ERROR] Missing node_url for receiver {receiver_id}")
         return jsonify({"status": "error", "message": "Missing node URL"}), 500
 
     try:
-        url = f"{node_url}/connection/{version}/single/receivers/{receiver_id}/active/"
-        r = requests.get(url, timeout=2)
+        url = connection_url(receiver, f"single/receivers/{receiver_id}/active/")
+        r = http_client.get(url)
 
         if r.status_code == 200:
             data = r.json()
@@ -81,12 +116,12 @@ def get_current_sender(receiver_id):
                     "current_sender_node": "Unknown"
                 })
 
-            sender = next((s for s in sources if s.get('id') == sender_id), None)
+            sender = resource_store.get("sources", sender_id)
             if sender:
                 return jsonify({
                     "status": "success",
-                    "current_sender_label": sender.get("label", "Unknown"),
-                    "current_sender_node": sender.get("node_name", "Unknown")
+                    "current_sender_label": sender.label or "Unknown",
+                    "current_sender_node": sender.node_name or "Unknown"
                 })
             else:
                 print(f"[WARNING] Sender ID {sender_id} not found in known sources")
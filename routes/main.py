@@ -3,22 +3,15 @@
 
 from flask import Blueprint, render_template
 from services.cache import read_cache
+from services import resource_store
 from services.data_loader import load_nodes
 import re
 
 main_bp = Blueprint('main', __name__)
 
 def extract_sort_key(item):
-    label = item.get("label", "").lower()
-    tags = item.get("tags", {})
-
-    triplet_str = next(
-        (t for k, v in tags.items() for t in v if "grouphint" in k and "[" in t),
-        ""
-    )
-
-    if not triplet_str:
-        triplet_str = label
+    label = (item.label or "").lower()
+    triplet_str = item.grouphint or label
 
     match = re.search(r"\[(\d+),\s*(\d+),\s*(\d+)]", triplet_str)
     if match:
@@ -34,8 +27,8 @@ def extract_sort_key(item):
 def index():
     cache = read_cache()
 
-    receivers = sorted(cache['receivers'], key=extract_sort_key)
-    sources   = sorted(cache['sources'], key=extract_sort_key)
+    receivers = [r.to_dict() for r in sorted(cache['receivers'], key=extract_sort_key)]
+    sources   = [s.to_dict() for s in sorted(cache['sources'], key=extract_sort_key)]
 
     nodes = load_nodes()
 
@@ -48,5 +41,6 @@ def index():
         receiver_count=len(receivers),
         source_count=len(sources),
         selected_receiver_id=None,
-        selected_source_id=None
+        selected_source_id=None,
+        cache_generation=resource_store.generation()
     )
@@ -3,10 +3,12 @@
 
 from flask import Blueprint, request, jsonify, render_template, redirect
 from services.data_loader import load_nodes, save_nodes
-from services.nmos_discovery import detect_nmos_and_connection_versions
+from services.nmos_discovery import get_node_versions
 from services.cache import read_cache as load_cache
 from services.logical import load_logical_ids, save_logical_ids
+import os
 import json
+import time
 import asyncio
 import builtins
 
@@ -55,7 +57,7 @@ def save_nodes_route():
 def detect_versions():
     data = request.json
     node_url = data['url']
-    versions = detect_nmos_and_connection_versions(node_url)
+    versions = get_node_versions(node_url, force=True)
     if versions["nmos"] and versions["connection"]:
         return jsonify({"status": "success", "versions": versions})
     else:
@@ -87,6 +89,7 @@ def update_settings():
 
         with open("settings.json", "w") as f:
             json.dump(settings_data, f, indent=2)
+        _settings_cache["settings"] = None
 
         if old_bmd != new_bmd:
             loop = getattr(builtins, "main_event_loop", None)
@@ -113,23 +116,29 @@ def update_settings():
 def logical_page():
     from services.cache import read_cache
     from services.logical import load_logical_ids
-    from services.nmos_discovery import get_resource_type
 
     cache = read_cache()
-    senders = cache.get("sources", [])
-    receivers = cache.get("receivers", [])
+    senders = [dict(s.to_dict(), essence_type=s.type) for s in cache.get("sources", [])]
+    receivers = [dict(r.to_dict(), essence_type=r.type) for r in cache.get("receivers", [])]
     logical_ids = load_logical_ids()
 
-    for s in senders:
-        s["essence_type"] = get_resource_type(s)
-    for r in receivers:
-        r["essence_type"] = get_resource_type(r)
-
     return render_template("logical.html",
                            senders=senders,
                            receivers=receivers,
                            logical_ids=logical_ids)
 
+def notify_emulator(logicals):
+    # The emulator applies the edit in memory from the saved groups, no reload or rediscovery
+    emulator = getattr(builtins, "emulator_instance", None)
+    loop = getattr(builtins, "main_event_loop", None)
+
+    if emulator and loop:
+        try:
+            asyncio.run_coroutine_threadsafe(emulator.apply_logical_update(logicals), loop)
+            print("[SETTINGS] BMD Emulator updated after logical update.")
+        except Exception as e:
+            print(f"[SETTINGS] Failed to notify emulator: {e}")
+
 @settings_bp.route("/settings/logical_ids", methods=["POST"])
 def add_logical_id():
     logical_name = request.form.get("logical_name")
@@ -163,15 +172,7 @@ def add_logical_id():
 
     save_logical_ids(logicals)
 
-    emulator = getattr(builtins, "emulator_instance", None)
-    loop = getattr(builtins, "main_event_loop", None)
-
-    if emulator and loop:
-        try:
-            asyncio.run_coroutine_threadsafe(emulator.reload_and_broadcast(), loop)
-            print("[SETTINGS] BMD Emulator reloaded after logical update.")
-        except Exception as e:
-            print(f"[SETTINGS] Failed to notify emulator: {e}")
+    notify_emulator(logicals)
 
     return redirect("/logical")
 
@@ -187,15 +188,7 @@ def delete_logical_id():
         save_logical_ids(logicals)
         print(f"[INFO] Deleted logical group: {entry_type} → {logical_name}")
 
-    emulator = getattr(builtins, "emulator_instance", None)
-    loop = getattr(builtins, "main_event_loop", None)
-
-    if emulator and loop:
-        try:
-            asyncio.run_coroutine_threadsafe(emulator.reload_and_broadcast(), loop)
-            print("[SETTINGS] BMD Emulator reloaded after logical update.")
-        except Exception as e:
-            print(f"[SETTINGS] Failed to notify emulator: {e}")
+    notify_emulator(logicals)
 
     return redirect("/logical")
 
@@ -227,15 +220,7 @@ def update_logical_id():
 
     save_logical_ids(logicals)
 
-    emulator = getattr(builtins, "emulator_instance", None)
-    loop = getattr(builtins, "main_event_loop", None)
-
-    if emulator and loop:
-        try:
-            asyncio.run_coroutine_threadsafe(emulator.reload_and_broadcast(), loop)
-            print("[SETTINGS] BMD Emulator reloaded after logical update.")
-        except Exception as e:
-            print(f"[SETTINGS] Failed to notify emulator: {e}")
+    notify_emulator(logicals)
 
     return redirect("/logical")
 
@@ -244,7 +229,30 @@ def load_settings():
         "refresh_interval": 300,
         "patch_secondary": True,
         "enable_restapi": True,
-        "enable_bmd_emulator": False
+        "enable_bmd_emulator": False,
+        "bmd_salvo_output": False,
+        "bmd_client_queue": 64,
+        "bmd_write_timeout": 5,
+        "discovery_workers": 32,
+        "discovery_per_host": 2,
+        "refresh_min_interval": 10,
+        "refresh_max_backoff": 1800,
+        "liveness_interval": 30,
+        "liveness_timeout": 1,
+        "http_connect_timeout": 2,
+        "http_timeout": 3,
+        "http_pool_connections": 512,
+        "http_pool_maxsize": 4,
+        "version_cache_ttl": 86400,
+        "discovery_mode": "nodes",
+        "registry_url": "",
+        "sdp_cache_ttl": 300,
+        "activation_mode": "immediate",
+        "activation_margin_ms": 250,
+        "patch_per_node": 4,
+        "patch_retries": 2,
+        "breaker_failures": 3,
+        "breaker_reset": 10
     }
 
     try:
@@ -255,3 +263,21 @@ def load_settings():
     except Exception as e:
         print(f"[WARNING] Could not load settings.json, using defaults. Error: {e}")
         return default_settings
+
+_settings_cache = {"settings": None, "mtime": None, "checked": 0}
+
+def get_settings(max_age=1.0):
+    # load_settings() for the take path and the patch engine loop: settings.json is
+    # stat'ed at most once per max_age seconds and only parsed again when it changed
+    cache = _settings_cache
+    now = time.monotonic()
+    if cache["settings"] is None or now - cache["checked"] >= max_age:
+        try:
+            mtime = os.path.getmtime("settings.json")
+        except OSError:
+            mtime = None
+        if cache["settings"] is None or mtime != cache["mtime"]:
+            cache["settings"] = load_settings()
+            cache["mtime"] = mtime
+        cache["checked"] = now
+    return cache["settings"]
@@ -3,49 +3,247 @@
 
 import os
 import json
+import marshal
+import tempfile
 import threading
 import time
+import concurrent.futures
+from urllib.parse import urlparse
 from services.data_loader import load_nodes
-from services.nmos_discovery import fetch_node_data, get_resource_type
+from services.nmos_discovery import fetch_node_data
+from services import resource_store, resources, node_health, http_client
+
+CACHE_FILE = "data_cache.bin"
+LEGACY_CACHE_FILE = "data_cache.json"
+
+_refresh_lock = threading.Lock()
+_save_timer = None
+_save_lock = threading.Lock()
+_write_lock = threading.Lock()
+last_refresh_stats = {"duration": None, "nodes": {}}
+discovery_progress = {
+    "state": "pending",
+    "mode": None,
+    "total": 0,
+    "done": 0,
+    "started": None,
+    "finished": None,
+    "completed_runs": 0,
+    "error": None
+}
+
+def get_discovery_limits():
+    from routes.settings import load_settings
+    settings = load_settings()
+    max_workers = max(1, int(settings.get("discovery_workers", 32)))
+    per_host = max(1, int(settings.get("discovery_per_host", 2)))
+    return max_workers, per_host
+
+def node_host(node):
+    return urlparse(node.get('url', '')).netloc or node.get('url', '')
+
+def fetch_node_timed(node, host_slots):
+    with host_slots[node_host(node)]:
+        started = time.monotonic()
+        node_data = fetch_node_data(node)
+        return node_data, time.monotonic() - started
+
+def begin_discovery_progress(mode, total):
+    discovery_progress.update({
+        "state": "running",
+        "mode": mode,
+        "total": total,
+        "done": 0,
+        "started": time.time(),
+        "finished": None,
+        "error": None
+    })
+
+def step_discovery_progress():
+    discovery_progress["done"] += 1
+
+def finish_discovery_progress(error=None):
+    discovery_progress["state"] = "failed" if error else "done"
+    discovery_progress["finished"] = time.time()
+    discovery_progress["error"] = error
+    discovery_progress["completed_runs"] += 1
+
+def get_discovery_mode():
+    from routes.settings import load_settings
+    return load_settings().get("discovery_mode", "nodes")
 
 def refresh_discovery():
+    if get_discovery_mode() == "registry":
+        from services.nmos_registry import get_registry_client
+        get_registry_client().sync()
+        return
+
+    with _refresh_lock:
+        try:
+            _refresh_nodes()
+        except Exception as e:
+            finish_discovery_progress(str(e))
+            raise
+
+def _refresh_nodes():
     print("[INFO] Refreshing NMOS discovery cache...")
-    nodes = load_nodes()
+    started = time.monotonic()
+    nodes = [n for n in load_nodes() if isinstance(n, dict) and n.get('url')]
+    max_workers, per_host = get_discovery_limits()
+    begin_discovery_progress("nodes", len(nodes))
+
+    host_slots = {}
+    for node in nodes:
+        host_slots.setdefault(node_host(node), threading.BoundedSemaphore(per_host))
+
+    results = {}
+    timings = {}
+
+    if nodes:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(nodes))) as executor:
+            futures = {executor.submit(fetch_node_timed, node, host_slots): index for index, node in enumerate(nodes)}
+            for future in concurrent.futures.as_completed(futures):
+                index = futures[future]
+                name = nodes[index].get('name') or nodes[index]['url']
+                step_discovery_progress()
+                try:
+                    node_data, duration = future.result()
+                except Exception as e:
+                    print(f"[ERROR] Discovery failed for node {name}: {e}")
+                    timings[name] = {"status": "error", "message": str(e)}
+                    if isinstance(e, http_client.TRANSPORT_ERRORS):
+                        node_health.record_failure(nodes[index]['url'], "discovery failed")
+                    continue
+
+                node_url = nodes[index]['url'].rstrip('/')
+                receivers = node_data.get("receivers", [])
+                sources = node_data.get("sources", [])
+
+                if node_data.get("errors"):
+                    status = "error"
+                    if node_data.get("unreachable"):
+                        node_health.record_failure(node_url, "discovery failed")
+                    receivers = resource_store.by_node("receivers", node_url)
+                    sources = resource_store.by_node("sources", node_url)
+                elif resources.payload_fingerprint(receivers + sources) == resource_store.node_fingerprint(node_url):
+                    status = "unchanged"
+                    receivers = resources.rebind(resource_store.by_node("receivers", node_url), node_data["node"])
+                    sources = resources.rebind(resource_store.by_node("sources", node_url), node_data["node"])
+                else:
+                    status = "ok"
+                    receivers = resources.from_payloads(receivers, "receivers", node_data["node"])
+                    sources = resources.from_payloads(sources, "sources", node_data["node"])
+
+                if status != "error":
+                    node_health.mark_up(node_url)
+                results[index] = (receivers, sources)
+                timings[name] = {
+                    "status": status,
+                    "duration": round(duration, 3),
+                    "receivers": len(receivers),
+                    "sources": len(sources)
+                }
+                print(f"[DISCOVERY] {name}: {len(receivers)} receivers, {len(sources)} sources in {duration:.2f}s ({status})")
+
     all_receivers = []
     all_sources = []
+    for index in sorted(results):
+        all_receivers.extend(results[index][0])
+        all_sources.extend(results[index][1])
 
-    for node in nodes:
-        node_data = fetch_node_data(node)
+    diff = resource_store.replace_all(all_receivers, all_sources)
+    if diff:
+        save_cache_snapshot()
+        summary = ", ".join(
+            f"{kind} +{len(diff[kind]['added'])} -{len(diff[kind]['removed'])} ~{len(diff[kind]['modified'])}"
+            for kind in resource_store.KINDS
+        )
+        print(f"[INFO] Cache generation {diff['generation']}: {summary}")
+    else:
+        print("[INFO] No resource changes since last refresh.")
 
-        for r in node_data.get("receivers", []):
-            r["type"] = get_resource_type(r)
+    total = time.monotonic() - started
+    last_refresh_stats["duration"] = round(total, 3)
+    last_refresh_stats["nodes"] = timings
+    finish_discovery_progress()
 
-        for s in node_data.get("sources", []):
-            s["type"] = get_resource_type(s)
+    print(f"[INFO] Discovery cache updated with {len(nodes)} nodes, {len(all_receivers)} receivers, {len(all_sources)} sources in {total:.2f}s.")
 
-        all_receivers.extend(node_data.get("receivers", []))
-        all_sources.extend(node_data.get("sources", []))
+def save_cache_snapshot():
+    snapshot = resource_store.current()
+    cache = resources.to_snapshot(snapshot["receivers"], snapshot["sources"], snapshot["generation"])
 
-    cache = {
-        "receivers": all_receivers,
-        "sources": all_sources
-    }
+    # Write next to the live file and rename over it, readers never see a partial snapshot
+    with _write_lock:
+        directory = os.path.dirname(os.path.abspath(CACHE_FILE))
+        fd, tmp_path = tempfile.mkstemp(prefix=".data_cache.", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                # marshal keeps loading fast. It is tied to the Python version and not meant for untrusted
+                # files: an unreadable snapshot is simply dropped and rebuilt by discovery
+                f.write(marshal.dumps(cache))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, CACHE_FILE)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
 
-    with open("data_cache.json", "w") as f:
-        json.dump(cache, f, indent=2)
+def schedule_snapshot_save(delay=2.0):
+    global _save_timer
 
-    print(f"[INFO] Discovery cache updated with {len(nodes)} nodes, {len(all_receivers)} receivers, {len(all_sources)} sources.")
+    def save():
+        global _save_timer
+        with _save_lock:
+            _save_timer = None
+        try:
+            save_cache_snapshot()
+        except Exception as e:
+            print(f"[ERROR] Failed to save cache snapshot: {e}")
+
+    with _save_lock:
+        if _save_timer is None:
+            _save_timer = threading.Timer(delay, save)
+            _save_timer.daemon = True
+            _save_timer.start()
 
 def read_cache():
-    if not os.path.exists("data_cache.json"):
+    snapshot = resource_store.current()
+    return {"receivers": snapshot["receivers"], "sources": snapshot["sources"]}
+
+def load_cache_snapshot():
+    empty = {"receivers": [], "sources": [], "generation": 0}
+    started = time.monotonic()
+
+    if os.path.exists(CACHE_FILE):
+        try:
+            with open(CACHE_FILE, "rb") as f:
+                data = marshal.loads(f.read())
+            if not isinstance(data, dict) or data.get("schema") != resources.SNAPSHOT_SCHEMA:
+                print(f"[WARNING] {CACHE_FILE} has an unsupported schema, ignoring it.")
+                return empty
+            cache = resources.from_snapshot(data)
+        except Exception as e:
+            print(f"[ERROR] Failed to read cache: {e}")
+            return empty
+    elif os.path.exists(LEGACY_CACHE_FILE):
+        try:
+            with open(LEGACY_CACHE_FILE, "r") as f:
+                cache = resources.from_snapshot(json.load(f))
+            cache["migrated"] = True
+            print(f"[INFO] Migrating {LEGACY_CACHE_FILE} to {CACHE_FILE}")
+        except Exception as e:
+            print(f"[ERROR] Failed to read cache: {e}")
+            return empty
+    else:
         print("[WARNING] Cache file missing.")
-        return {"nodes": [], "receivers": [], "sources": []}
-    try:
-        with open("data_cache.json", "r") as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"[ERROR] Failed to read cache: {e}")
-        return {"nodes": [], "receivers": [], "sources": []}
+        return empty
+
+    print(f"[INFO] Loaded cache snapshot (generation {cache['generation']}): {len(cache['receivers'])} receivers, {len(cache['sources'])} sources in {time.monotonic() - started:.3f}s")
+    return cache
 
 def get_refresh_interval():
     try:
@@ -58,11 +256,30 @@ def get_refresh_interval():
         return 600
 
 def start_auto_refresh():
-    def loop():
-        while True:
+    if get_discovery_mode() == "registry":
+        from services.nmos_registry import start_registry_watcher
+        start_registry_watcher()
+        return
+
+    from services.node_scheduler import start_scheduler
+    start_scheduler()
+
+def start_background_discovery():
+    # One discovery pass off the startup path, then hand over to the scheduler or registry watcher
+    if get_discovery_mode() == "registry":
+        try:
+            start_auto_refresh()
+        except Exception as e:
+            # Keep serving from the snapshot, like a failed first pass in nodes mode
+            print(f"[ERROR] Registry discovery could not start: {e}")
+            finish_discovery_progress(str(e))
+        return
+
+    def run():
+        try:
             refresh_discovery()
-            interval = get_refresh_interval()
-            print(f"[INFO] Next auto refresh in {interval} seconds.")
-            time.sleep(interval)
-    thread = threading.Thread(target=loop, daemon=True)
-    thread.start()
+        except Exception as e:
+            print(f"[ERROR] Initial discovery failed: {e}")
+        start_auto_refresh()
+
+    threading.Thread(target=run, daemon=True).start()
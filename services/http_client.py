@@ -0,0 +1,57 @@
+# /services/http_client.py
+# by Arnaud Cresp - 2025
+
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+_session = None
+_timeout = None
+_lock = threading.Lock()
+
+# Failures where the node never answered, as opposed to an HTTP error status
+TRANSPORT_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+def _create_session():
+    from routes.settings import load_settings
+    settings = load_settings()
+
+    per_host = int(settings.get("http_pool_maxsize", 4))
+    adapter = HTTPAdapter(
+        pool_connections=int(settings.get("http_pool_connections", 512)),
+        pool_maxsize=per_host,
+        pool_block=True,
+        max_retries=0
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    timeout = (
+        float(settings.get("http_connect_timeout", 2)),
+        float(settings.get("http_timeout", 3))
+    )
+    print(f"[HTTP] Pooled client ready: {per_host} connections per host, timeout {timeout}")
+    return session, timeout
+
+def get_session():
+    global _session, _timeout
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session, _timeout = _create_session()
+    return _session
+
+def request(method, url, **kwargs):
+    session = get_session()
+    kwargs.setdefault("timeout", _timeout)
+    return session.request(method, url, **kwargs)
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+def patch(url, **kwargs):
+    return request("PATCH", url, **kwargs)
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
@@ -1,113 +1,389 @@
 # /services/nmos_connection.py
 # by Arnaud Cresp - 2025
 
-import requests
-import concurrent.futures
-from .nmos_discovery import fetch_node_data, get_resource_type
-from routes.settings import load_settings
-from utils.sdp_filter import remove_secondary_streams
-
-def load_receivers_and_sources(nodes):
-    receivers, sources = [], []
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = {executor.submit(fetch_node_data, node): node for node in nodes}
-        for future in concurrent.futures.as_completed(futures):
-            node = futures[future]
-            try:
-                data = future.result()
-                for r in data.get('receivers', []):
-                    r.update({
-                        'node_name': node['name'],
-                        'node_url': node['url'],
-                        'versions': node.get('versions', {}),
-                        'type': get_resource_type(r)
-                    })
-                    receivers.append(r)
-                for s in data.get('sources', []):
-                    s.update({
-                        'node_name': node['name'],
-                        'node_url': node['url'],
-                        'versions': node.get('versions', {}),
-                        'type': get_resource_type(s)
-                    })
-                    sources.append(s)
-            except Exception as e:
-                print(f"Error fetching node {node['name']}: {e}")
-    return receivers, sources
+import asyncio
+import time
+from .nmos_discovery import lookup_resource, build_api_url
+from services import resource_store, sdp_cache, patch_engine, node_health
+from services.cache import get_discovery_mode
+from routes.settings import get_settings
 
-def change_source(nodes, receiver_id, sender_id):
-    receivers, sources = load_receivers_and_sources(nodes)
+SENDER_ACTIVATION = {
+    "activation": {"mode": "activate_immediate"},
+    "master_enable": True
+}
+TAI_OFFSET = 37
+# How long /active is re-read after a scheduled activation before giving up on confirming it
+CONFIRM_WINDOW = 1.0
 
-    receiver = next((r for r in receivers if r['id'] == receiver_id), None)
-    sender = next((s for s in sources if s['id'] == sender_id), None)
-    if not sender:
-        print(f"[WARN] Sender ID {sender_id} not found in loaded sources")
+# Only touched from the patch engine loop
+_bulk_support = {}
+# Senders this engine activated, dropped when discovery reports the sender changed
+_active_senders = set()
+sender_stats = {"activated": 0, "skipped": 0}
 
+class BulkUnsupported(Exception):
+    pass
 
-    if not receiver or not sender:
-        return {"status": "error", "message": "Receiver or sender not found"}
+def resolve_resource(nodes, kind, resource_id):
+    # nodes: nodes.json entries, None to read them only when a lookup is needed
+    resource = resource_store.get(kind, resource_id)
+    if resource is None:
+        if get_discovery_mode() == "registry":
+            from services.nmos_registry import get_registry_client
+            print(f"[INFO] {resource_id} not in resource store, looking it up on the registry")
+            resource = get_registry_client().lookup(kind, resource_id)
+        else:
+            print(f"[INFO] {resource_id} not in resource store, looking it up on nodes")
+            if nodes is None:
+                from services.data_loader import load_nodes
+                nodes = load_nodes()
+            resource = lookup_resource(nodes, kind, resource_id)
+        if resource is not None:
+            resource_store.put(kind, resource)
+    return resource
 
-    try:
-        sdp_url = f"{sender['node_url']}connection/{sender['versions']['connection']}/single/senders/{sender_id}/transportfile/"
-        sdp_data = requests.get(sdp_url, timeout=2).text
-
-        settings = load_settings()
-        if not settings.get("patch_secondary", False):
-            print("[INFO] Secondary streams will be removed from SDP")
-            sdp_data = remove_secondary_streams(sdp_data)
-
-
-        patch_receiver = {
-            "sender_id": sender_id,
-            "master_enable": True,
-            "transport_file": {
-                "data": sdp_data,
-                "type": "application/sdp"
-            },
-            "activation": {"mode": "activate_immediate"}
-        }
+def connection_url(resource, path):
+    version = resource.versions.get('connection') or 'v1.1'
+    return build_api_url(resource.node_url, 'connection', version, path)
 
-        patch_url_receiver = f"{receiver['node_url']}connection/{receiver['versions']['connection']}/single/receivers/{receiver_id}/staged"
-        r_patch = requests.patch(patch_url_receiver, json=patch_receiver, timeout=2)
+def sender_is_active(sender):
+    # Either we activated it since its last IS-04 change, or IS-04 says it is active
+    return sender.id in _active_senders or sender.active is True
 
-        if r_patch.status_code != 200:
-            return {"status": "error", "message": r_patch.text, "code": r_patch.status_code}
+def on_store_change(diff):
+    for sender_id in diff["sources"]["modified"] + diff["sources"]["removed"]:
+        _active_senders.discard(sender_id)
 
-        patch_sender = {
-            "activation": {"mode": "activate_immediate"},
-            "master_enable": True
-        }
+resource_store.subscribe(on_store_change)
 
-        patch_url_sender = f"{sender['node_url']}connection/{sender['versions']['connection']}/single/senders/{sender_id}/staged"
-        s_patch = requests.patch(patch_url_sender, json=patch_sender, timeout=2)
+def staged_path(resource):
+    return "senders" if resource.kind == "sources" else "receivers"
 
-        if s_patch.status_code != 200:
-            return {"status": "error", "message": s_patch.text, "code": s_patch.status_code}
+async def bulk_supported(resource):
+    url = connection_url(resource, "bulk/")
+    if url in _bulk_support:
+        return _bulk_support[url]
 
-        return {"status": "success", "message": "Source changed and sender activated successfully"}
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+    try:
+        r = await patch_engine.get(url)
+        listing = r.json() if r.status_code == 200 else []
+    except Exception:
+        # Unknown for now, ask again on the next batch
+        return False
 
-def disconnect_receiver(nodes, receiver_id):
-    receivers, _ = load_receivers_and_sources(nodes)
-    receiver = next((r for r in receivers if r['id'] == receiver_id), None)
+    supported = isinstance(listing, list) and any(str(i).strip('/') in ("senders", "receivers") for i in listing)
+    _bulk_support[url] = supported
+    print(f"[INFO] IS-05 bulk API {'available' if supported else 'not available'} on {resource.node_url}")
+    return supported
 
-    if not receiver:
-        return {"status": "error", "message": "Receiver not found"}
+def mark_bulk_unsupported(resource):
+    _bulk_support[connection_url(resource, "bulk/")] = False
 
+async def patch_single(resource, params):
     try:
-        patch_data = {
-            "sender_id": None,
-            "master_enable": False,
-            "activation": {"mode": "activate_immediate"}
+        url = connection_url(resource, f"single/{staged_path(resource)}/{resource.id}/staged")
+        r = await patch_engine.request_with_retry("PATCH", url, json=params)
+        if r.status_code != 200:
+            return {"ok": False, "message": r.text, "code": r.status_code}
+        return {"ok": True}
+    except node_health.NodeUnavailable as e:
+        return {"ok": False, "message": str(e), "code": 503}
+    except asyncio.TimeoutError:
+        return {"ok": False, "message": "Timed out"}
+    except Exception as e:
+        return {"ok": False, "message": str(e)}
+
+async def patch_bulk(items):
+    # items all live on the same node and are of the same kind
+    body = [{"id": resource.id, "params": params} for resource, params in items]
+    r = await patch_engine.request_with_retry("POST", connection_url(items[0][0], f"bulk/{staged_path(items[0][0])}"), json=body)
+    if r.status_code in (404, 405, 501):
+        raise BulkUnsupported(r.status_code)
+    if r.status_code != 200:
+        return [{"ok": False, "message": r.text, "code": r.status_code} for _ in items]
+
+    answers = {a.get("id"): a for a in r.json() if isinstance(a, dict)}
+    results = []
+    for resource, _ in items:
+        answer = answers.get(resource.id) or {}
+        code = answer.get("code", 500)
+        if 200 <= code < 300:
+            results.append({"ok": True})
+        else:
+            results.append({"ok": False, "message": answer.get("error") or "No result in bulk response", "code": code})
+    return results
+
+async def patch_group(items):
+    if await bulk_supported(items[0][0]):
+        try:
+            return await patch_bulk(items)
+        except BulkUnsupported:
+            print(f"[WARN] Bulk endpoint rejected by {items[0][0].node_url}, using single PATCHes")
+            mark_bulk_unsupported(items[0][0])
+        except node_health.NodeUnavailable as e:
+            return [{"ok": False, "message": str(e), "code": 503} for _ in items]
+        except asyncio.TimeoutError:
+            return [{"ok": False, "message": "Timed out"} for _ in items]
+        except Exception as e:
+            return [{"ok": False, "message": str(e)} for _ in items]
+
+    return list(await asyncio.gather(*(patch_single(*item) for item in items)))
+
+async def stage_all(items):
+    # PATCH staged params for many resources, one bulk request per node and kind where possible
+    groups = {}
+    for index, (resource, _) in enumerate(items):
+        groups.setdefault((connection_url(resource, ""), resource.kind), []).append(index)
+
+    async def run(indexes):
+        group = [items[i] for i in indexes]
+        return await patch_group(group) if len(group) > 1 else [await patch_single(*group[0])]
+
+    results = [None] * len(items)
+    outcomes = await asyncio.gather(*(run(indexes) for indexes in groups.values()))
+    for indexes, outcome in zip(groups.values(), outcomes):
+        for i, result in zip(indexes, outcome):
+            results[i] = result
+    return results
+
+def receiver_patch(sender_id, sdp_data, scheduled=False):
+    patch = {
+        "sender_id": sender_id,
+        "master_enable": True,
+        "transport_file": {
+            "data": sdp_data,
+            "type": "application/sdp"
         }
+    }
+    if not scheduled:
+        patch["activation"] = {"mode": "activate_immediate"}
+    return patch
 
-        patch_url = f"{receiver['node_url']}connection/{receiver['versions']['connection']}/single/receivers/{receiver_id}/staged"
-        r_patch = requests.patch(patch_url, json=patch_data, timeout=2)
+def get_activation_settings():
+    settings = get_settings()
+    scheduled = settings.get("activation_mode", "immediate") == "scheduled"
+    margin = max(0, int(settings.get("activation_margin_ms", 250))) / 1000
+    return scheduled, margin
 
-        if r_patch.status_code != 200:
-            return {"status": "error", "message": r_patch.text, "code": r_patch.status_code}
+def tai_timestamp(offset=0.0):
+    # IS-05 absolute times are TAI "<seconds>:<nanoseconds>", the host clock is expected to be NTP/PTP synced
+    ns = time.time_ns() + int((TAI_OFFSET + offset) * 1e9)
+    return f"{ns // 1_000_000_000}:{ns % 1_000_000_000}"
 
-        return {"status": "success", "message": "Disconnected successfully"}
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+async def schedule_all(resources, margin):
+    # One shared activation time for every staged leg, fired after everything is staged
+    requested_time = tai_timestamp(margin)
+    params = {"activation": {"mode": "activate_scheduled_absolute", "requested_time": requested_time}}
+    deadline = time.monotonic() + margin
+    return requested_time, deadline, await stage_all([(resource, params) for resource in resources])
+
+async def confirm_active(legs, deadline):
+    # legs: [(receiver, sender_id)], True when /active shows the expected sender.
+    # Some receivers update /active a little after the activation time, so it is re-read for CONFIRM_WINDOW
+    await asyncio.sleep(max(0, deadline - time.monotonic()) + 0.05)
+    give_up = time.monotonic() + CONFIRM_WINDOW
+
+    async def check(leg):
+        receiver, sender_id = leg
+        url = connection_url(receiver, f"single/receivers/{receiver.id}/active")
+        while True:
+            try:
+                r = await patch_engine.get(url)
+                active = r.json() if r.status_code == 200 else {}
+                if active.get("sender_id") == sender_id and active.get("master_enable") is True:
+                    return True
+            except Exception:
+                pass
+            if time.monotonic() >= give_up:
+                return False
+            await asyncio.sleep(0.1)
+
+    return list(await asyncio.gather(*(check(leg) for leg in legs)))
+
+def error_result(result):
+    error = {"status": "error", "message": result.get("message", "")}
+    if result.get("code"):
+        error["code"] = result["code"]
+    return error
+
+async def resolve_async(nodes, kind, resource_id):
+    # Store hits stay on the loop, a miss looks the resource up over HTTP in a worker thread
+    return resource_store.get(kind, resource_id) or await asyncio.to_thread(resolve_resource, nodes, kind, resource_id)
+
+async def change_sources_async(nodes, pairs):
+    # pairs: [(receiver_id, sender_id)], results come back in the same order
+    pairs = list(pairs)
+    results = [None] * len(pairs)
+    started = time.monotonic()
+
+    def finish(index, result):
+        # duration_ms: time from the start of the batch until this leg got its final result
+        results[index] = dict(result, duration_ms=round((time.monotonic() - started) * 1000, 1))
+
+    # Last write wins when the same receiver appears twice in one batch
+    latest = {}
+    for index, (receiver_id, _) in enumerate(pairs):
+        latest[receiver_id] = index
+
+    receivers = {}
+    senders = {}
+    legs = []
+    for receiver_id, index in latest.items():
+        sender_id = pairs[index][1]
+        if receiver_id not in receivers:
+            receivers[receiver_id] = await resolve_async(nodes, 'receivers', receiver_id)
+        if sender_id not in senders:
+            senders[sender_id] = await resolve_async(nodes, 'sources', sender_id)
+            if not senders[sender_id]:
+                print(f"[WARN] Sender ID {sender_id} not found in loaded sources")
+        if not receivers[receiver_id] or not senders[sender_id]:
+            finish(index, {"status": "error", "message": "Receiver or sender not found"})
+        else:
+            legs.append(index)
+
+    patch_secondary = get_settings().get("patch_secondary", False)
+    scheduled, margin = get_activation_settings()
+    if legs and not patch_secondary:
+        print("[INFO] Secondary streams will be removed from SDP")
+
+    async def fetch_sdp(sender):
+        sdp_data = sdp_cache.lookup(sender, patch_secondary)
+        if sdp_data is not None:
+            return sdp_data
+        r = await patch_engine.get(connection_url(sender, f"single/senders/{sender.id}/transportfile/"))
+        if r.status_code != 200:
+            # Never cache an error body, the take will fail on it as before
+            return r.text
+        return sdp_cache.remember(sender, r.text, patch_secondary)
+
+    wanted = list({pairs[i][1] for i in legs})
+    fetched = await asyncio.gather(*(fetch_sdp(senders[s]) for s in wanted), return_exceptions=True)
+    sdps = dict(zip(wanted, fetched))
+
+    receiver_legs = []
+    for index in legs:
+        sdp_data = sdps[pairs[index][1]]
+        if isinstance(sdp_data, asyncio.TimeoutError):
+            finish(index, {"status": "error", "message": "Timed out fetching the sender SDP"})
+        elif isinstance(sdp_data, node_health.NodeUnavailable):
+            finish(index, {"status": "error", "message": str(sdp_data), "code": 503})
+        elif isinstance(sdp_data, Exception):
+            finish(index, {"status": "error", "message": str(sdp_data)})
+        else:
+            receiver_legs.append(index)
+
+    receiver_items = [(receivers[pairs[i][0]], receiver_patch(pairs[i][1], sdps[pairs[i][1]], scheduled)) for i in receiver_legs]
+
+    if scheduled:
+        await scheduled_sources(pairs, receiver_legs, receiver_items, receivers, senders, finish, margin)
+    else:
+        staged = await stage_all(receiver_items)
+
+        activate = {}
+        for index, result in zip(receiver_legs, staged):
+            if result["ok"]:
+                activate.setdefault(pairs[index][1], []).append(index)
+            else:
+                finish(index, error_result(result))
+
+        # One activation per sender for the whole batch, none if it is already running
+        sender_ids = [s for s in activate if not sender_is_active(senders[s])]
+        activated = dict(zip(sender_ids, await stage_all([(senders[s], SENDER_ACTIVATION) for s in sender_ids])))
+        sender_stats["activated"] += len(sender_ids)
+        sender_stats["skipped"] += len(activate) - len(sender_ids)
+        for sender_id, indexes in activate.items():
+            result = activated.get(sender_id)
+            if result and result["ok"]:
+                _active_senders.add(sender_id)
+            for index in indexes:
+                if result is None:
+                    finish(index, {"status": "success", "message": "Source changed, sender already active"})
+                elif result["ok"]:
+                    finish(index, {"status": "success", "message": "Source changed and sender activated successfully"})
+                else:
+                    finish(index, error_result(result))
+
+    for index, (receiver_id, _) in enumerate(pairs):
+        if results[index] is None:
+            results[index] = dict(results[latest[receiver_id]])
+    return results
+
+async def scheduled_sources(pairs, receiver_legs, receiver_items, receivers, senders, finish, margin):
+    # Stage every receiver and sender without activating, then switch them all at one TAI time
+    # Senders that are already active are left alone
+    sender_ids = [s for s in dict.fromkeys(pairs[i][1] for i in receiver_legs) if not sender_is_active(senders[s])]
+    staged = await stage_all(receiver_items + [(senders[s], {"master_enable": True}) for s in sender_ids])
+    sender_ok = dict(zip(sender_ids, staged[len(receiver_items):]))
+
+    ready = []
+    for index, result in zip(receiver_legs, staged):
+        sender_result = sender_ok.get(pairs[index][1], {"ok": True})
+        if not result["ok"]:
+            finish(index, error_result(result))
+        elif not sender_result["ok"]:
+            finish(index, error_result(sender_result))
+        else:
+            ready.append(index)
+
+    if not ready:
+        return
+
+    ready_senders = list(dict.fromkeys(pairs[i][1] for i in ready if pairs[i][1] in sender_ok))
+    resources = [receivers[pairs[i][0]] for i in ready] + [senders[s] for s in ready_senders]
+    requested_time, deadline, fired = await schedule_all(resources, margin)
+    print(f"[INFO] Scheduled {len(ready)} receivers and {len(ready_senders)} senders for activation at {requested_time} (TAI)")
+
+    sender_fired = dict(zip(ready_senders, fired[len(ready):]))
+    _active_senders.update(s for s, result in sender_fired.items() if result["ok"])
+    sender_stats["activated"] += len(ready_senders)
+    confirm = []
+    for index, result in zip(ready, fired):
+        sender_result = sender_fired.get(pairs[index][1], {"ok": True})
+        if not result["ok"]:
+            finish(index, error_result(result))
+        elif not sender_result["ok"]:
+            finish(index, error_result(sender_result))
+        else:
+            confirm.append(index)
+
+    confirmed = await confirm_active([(receivers[pairs[i][0]], pairs[i][1]) for i in confirm], deadline)
+    for index, ok in zip(confirm, confirmed):
+        if ok:
+            finish(index, {"status": "success", "message": f"Source activated at {requested_time} (TAI)", "activation_time": requested_time, "confirmed": True})
+        else:
+            # Every PATCH was accepted, the switch most likely happened: report it unconfirmed, not failed
+            finish(index, {"status": "success", "message": f"Activation scheduled at {requested_time} (TAI), not yet confirmed by the receiver", "activation_time": requested_time, "confirmed": False})
+
+def change_sources(nodes, pairs):
+    return patch_engine.run(change_sources_async(nodes, pairs))
+
+def change_source(nodes, receiver_id, sender_id):
+    return change_sources(nodes, [(receiver_id, sender_id)])[0]
+
+async def disconnect_receivers_async(nodes, receiver_ids):
+    receiver_ids = list(receiver_ids)
+    results = [None] * len(receiver_ids)
+    legs = []
+    for index, receiver_id in enumerate(receiver_ids):
+        receiver = await resolve_async(nodes, 'receivers', receiver_id)
+        if not receiver:
+            results[index] = {"status": "error", "message": "Receiver not found"}
+        else:
+            legs.append((index, receiver))
+
+    patch_data = {
+        "sender_id": None,
+        "master_enable": False,
+        "activation": {"mode": "activate_immediate"}
+    }
+    staged = await stage_all([(receiver, patch_data) for _, receiver in legs])
+    for (index, _), result in zip(legs, staged):
+        results[index] = {"status": "success", "message": "Disconnected successfully"} if result["ok"] else error_result(result)
+    return results
+
+def disconnect_receivers(nodes, receiver_ids):
+    return patch_engine.run(disconnect_receivers_async(nodes, receiver_ids))
+
+def disconnect_receiver(nodes, receiver_id):
+    return disconnect_receivers(nodes, [receiver_id])[0]
@@ -1,9 +1,12 @@
 # /services/nmos_discovery.py
 # by Arnaud Cresp - 2025
 
-import requests
+from services import http_client, resources
 import json
 import os
+import time
+import threading
+import concurrent.futures
 
 def load_nodes():
     path = os.path.join(os.path.dirname(__file__), '..', 'data', 'nodes.json')
@@ -14,54 +17,108 @@ def load_nodes():
         print(f"[ERROR] Failed to load nodes.json: {e}")
         return []
 
+def build_api_url(base, api, version, path=""):
+    base = base.rstrip('/')
+    if '/x-nmos' not in base:
+        base = f"{base}/x-nmos"
+    return f"{base}/{api}/{version}/{path}"
+
+API_VERSIONS = ["v1.0", "v1.1", "v1.2", "v1.3"]
+VERSIONS_FILE = 'data_versions.json'
+
+_versions_cache = None
+_versions_lock = threading.Lock()
+
+def probe_node_version(node_url, version):
+    r = http_client.get(build_api_url(node_url, 'node', version, 'sources/'))
+    if r.status_code != 200:
+        return False
+    data = r.json()
+    # Empty list is also valid – node supports API
+    return isinstance(data, list) and all(isinstance(d, dict) for d in data)
+
+def probe_connection_version(node_url, version):
+    r = http_client.get(build_api_url(node_url, 'connection', version, 'single/receivers/'))
+    if r.status_code != 200:
+        return False
+    data = r.json()
+    if not isinstance(data, list):
+        return False
+    if len(data) == 0:
+        return True  # Empty but valid
+    if any(isinstance(d, dict) and "id" in d for d in data):
+        return True
+    return all(isinstance(d, str) and len(d.strip("/")) >= 30 for d in data)
+
 def detect_nmos_and_connection_versions(node_url):
     versions = {
         "nmos": None,
         "connection": None
     }
 
-    for version in reversed(["v1.0", "v1.1", "v1.2", "v1.3"]):
+    probes = [("nmos", probe_node_version), ("connection", probe_connection_version)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(API_VERSIONS) * len(probes)) as executor:
+        futures = {
+            executor.submit(probe, node_url, version): (api, version)
+            for api, probe in probes
+            for version in API_VERSIONS
+        }
+        for future in concurrent.futures.as_completed(futures):
+            api, version = futures[future]
+            try:
+                supported = future.result()
+            except Exception:
+                continue
+            if supported and (versions[api] is None or API_VERSIONS.index(version) > API_VERSIONS.index(versions[api])):
+                versions[api] = version
+
+    return versions
+
+def load_versions_cache():
+    global _versions_cache
+    if _versions_cache is None:
         try:
-            url = f"{node_url}node/{version}/sources/"
-            r = requests.get(url, timeout=3)
-            if r.status_code == 200:
-                try:
-                    data = r.json()
-                    if isinstance(data, list) and all(isinstance(d, dict) for d in data):
-                        versions["nmos"] = version
-                        break
-                    if isinstance(data, list) and len(data) == 0:
-                        # Empty list is also valid – node supports API
-                        versions["nmos"] = version
-                        break
-                except Exception:
-                    continue
-        except Exception:
-            continue
-
-    for version in reversed(["v1.0", "v1.1", "v1.2", "v1.3"]):
+            with open(VERSIONS_FILE, 'r') as f:
+                _versions_cache = json.load(f)
+        except FileNotFoundError:
+            _versions_cache = {}
+        except Exception as e:
+            print(f"[ERROR] Failed to read {VERSIONS_FILE}: {e}")
+            _versions_cache = {}
+    return _versions_cache
+
+def get_versions_ttl():
+    from routes.settings import load_settings
+    return int(load_settings().get("version_cache_ttl", 86400))
+
+def get_node_versions(node_url, force=False):
+    key = node_url.rstrip('/')
+    with _versions_lock:
+        entry = load_versions_cache().get(key)
+    if entry and not force and time.time() - entry.get("detected_at", 0) < get_versions_ttl():
+        return dict(entry["versions"])
+
+    versions = detect_nmos_and_connection_versions(key)
+    print(f"[INFO] Detected API versions for {key}: {versions}")
+    if not versions["nmos"] or not versions["connection"]:
+        # Partial answer, probe again next time instead of pinning a fallback version for the TTL
+        return versions
+
+    with _versions_lock:
+        cache = load_versions_cache()
+        cache[key] = {"versions": versions, "detected_at": time.time()}
         try:
-            url = f"{node_url}connection/{version}/single/receivers/"
-            r = requests.get(url, timeout=3)
-            if r.status_code == 200:
-                try:
-                    data = r.json()
-                    if isinstance(data, list):
-                        if len(data) == 0:
-                            versions["connection"] = version  # Empty but valid
-                            break
-                        if any(isinstance(d, dict) and "id" in d for d in data):
-                            versions["connection"] = version
-                            break
-                        if all(isinstance(d, str) and len(d.strip("/")) >= 30 for d in data):
-                            versions["connection"] = version
-                            break
-                except Exception:
-                    continue
-        except Exception:
-            continue
+            with open(VERSIONS_FILE, 'w') as f:
+                json.dump(cache, f, indent=2)
+        except Exception as e:
+            print(f"[ERROR] Failed to write {VERSIONS_FILE}: {e}")
+    return dict(versions)
 
-    return versions
+def resolve_node_versions(node):
+    versions = {k: v for k, v in (node.get('versions') or {}).items() if v}
+    if versions.get('nmos') and versions.get('connection'):
+        return versions
+    return {**get_node_versions(node['url']), **versions}
 
 def get_resource_type(resource):
     if not isinstance(resource, dict):
@@ -123,56 +180,91 @@ def get_resource_type(resource):
 
 def fetch_node_data(node):
     node_url = node['url'].rstrip('/')
-    versions = node.get('versions') or detect_nmos_and_connection_versions(node_url)
-    nmos_version = versions.get('nmos', 'v1.3')
+    versions = resolve_node_versions(node)
+    nmos_version = versions.get('nmos') or 'v1.3'
 
     data = {
         'label': node.get('label', node.get('name', node_url)),
         'ip': node.get('ip', node_url),
         'version': nmos_version,
+        'node': resources.node_info(node['name'], node_url, versions),
         'receivers': [],
-        'sources': []
+        'sources': [],
+        'errors': [],
+        'unreachable': False
     }
 
-    def build_url(base, version, resource):
-        if '/x-nmos' in base:
-            return f"{base}/node/{version}/{resource}/"
-        else:
-            return f"{base}/x-nmos/node/{version}/{resource}/"
-
     try:
-        rcv_url = build_url(node_url, nmos_version, 'receivers')
-        r = requests.get(rcv_url, timeout=3)
+        rcv_url = build_api_url(node_url, 'node', nmos_version, 'receivers/')
+        r = http_client.get(rcv_url)
         r.raise_for_status()
         rcv_json = r.json()
         if isinstance(rcv_json, list):
-            receivers = [d for d in rcv_json if isinstance(d, dict)]
-            for item in receivers:
-                item['node_name'] = node['name']
-                item['node_url'] = node_url
-                item['versions'] = versions
-            data['receivers'] = receivers
+            data['receivers'] = [d for d in rcv_json if isinstance(d, dict)]
         else:
             print(f"[WARNING] Unexpected receivers format from {node['name']}: {type(rcv_json)}")
     except Exception as e:
         print(f"[ERROR] Failed to fetch receivers from {node['name']}: {e}")
+        data['errors'].append(str(e))
+        if isinstance(e, http_client.TRANSPORT_ERRORS):
+            data['unreachable'] = True
 
     try:
-        snd_url = build_url(node_url, nmos_version, 'senders')
-        r = requests.get(snd_url, timeout=3)
+        snd_url = build_api_url(node_url, 'node', nmos_version, 'senders/')
+        r = http_client.get(snd_url)
         r.raise_for_status()
         snd_json = r.json()
         if isinstance(snd_json, list):
-            senders = [d for d in snd_json if isinstance(d, dict)]
-            for item in senders:
-                item['node_name'] = node['name']
-                item['node_url'] = node_url
-                item['versions'] = versions
-            data['sources'] = senders
+            data['sources'] = [d for d in snd_json if isinstance(d, dict)]
         else:
             print(f"[WARNING] Unexpected senders format from {node['name']}: {type(snd_json)}")
     except Exception as e:
         print(f"[ERROR] Failed to fetch senders from {node['name']}: {e}")
+        data['errors'].append(str(e))
+        if isinstance(e, http_client.TRANSPORT_ERRORS):
+            data['unreachable'] = True
 
     return data
 
+def fetch_node_resource(node, kind, resource_id):
+    node_url = node['url'].rstrip('/')
+    versions = resolve_node_versions(node)
+    nmos_version = versions.get('nmos') or 'v1.3'
+    resource = 'senders' if kind == 'sources' else 'receivers'
+
+    r = http_client.get(build_api_url(node_url, 'node', nmos_version, f"{resource}/{resource_id}"))
+    if r.status_code != 200:
+        return None
+
+    item = r.json()
+    if not isinstance(item, dict) or item.get('id') != resource_id:
+        return None
+
+    return resources.from_payload(item, kind, resources.node_info(node.get('name'), node_url, versions))
+
+def fetch_resource_payload(resource):
+    # Records only keep what the patcher needs, the full IS-04 document is fetched on demand
+    nmos_version = resource.versions.get('nmos') or 'v1.3'
+    path = 'senders' if resource.kind == 'sources' else 'receivers'
+    r = http_client.get(build_api_url(resource.node_url, 'node', nmos_version, f"{path}/{resource.id}"))
+    r.raise_for_status()
+    return r.json()
+
+def lookup_resource(nodes, kind, resource_id):
+    candidates = [n for n in nodes if isinstance(n, dict) and n.get('url')]
+    if not candidates:
+        return None
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(16, len(candidates)))
+    try:
+        futures = [executor.submit(fetch_node_resource, node, kind, resource_id) for node in candidates]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                item = future.result()
+            except Exception:
+                continue
+            if item:
+                return item
+        return None
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
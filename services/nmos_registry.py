@@ -0,0 +1,279 @@
+# /services/nmos_registry.py
+# by Arnaud Cresp - 2025
+
+import json
+import threading
+import time
+from services import http_client, resource_store, resources
+from services.cache import schedule_snapshot_save, begin_discovery_progress, step_discovery_progress, finish_discovery_progress
+
+RESOURCE_KINDS = {"senders": "sources", "receivers": "receivers"}
+SUBSCRIBED_RESOURCES = ["nodes", "devices", "senders", "receivers"]
+PAGE_LIMIT = 1000
+
+_client = None
+_client_lock = threading.Lock()
+
+def version_key(version):
+    try:
+        return tuple(int(x) for x in version.lstrip('v').split('.'))
+    except Exception:
+        return (0,)
+
+class RegistryClient:
+    def __init__(self, query_url):
+        self.query_url = query_url.rstrip('/') + '/'
+        self.nodes = {}
+        self.devices = {}
+        self.lock = threading.RLock()
+        self.stopped = False
+        self.sockets = []
+
+    def fetch_all(self, resource):
+        # The default Query API page is the newest one, so walk forward from the oldest instead.
+        # Registries without paging ignore the parameters and return everything in one go
+        items = {}
+        url = f"{self.query_url}{resource}/"
+        params = {"paging.since": "0:0", "paging.limit": PAGE_LIMIT}
+        while url:
+            r = http_client.get(url, params=params)
+            r.raise_for_status()
+            page = r.json()
+            if not isinstance(page, list) or not page:
+                break
+            # Keyed by ID, a resource updated while paging shows up again on a later page
+            items.update((d["id"], d) for d in page if isinstance(d, dict) and d.get("id"))
+            next_url = r.links.get('next', {}).get('url')
+            url = next_url if next_url and next_url != r.url else None
+            params = None
+        return list(items.values())
+
+    def node_endpoint(self, device, node):
+        versions = {"nmos": None, "connection": None}
+        node_url = None
+
+        node_versions = (node.get("api") or {}).get("versions") or []
+        if node_versions:
+            versions["nmos"] = max(node_versions, key=version_key)
+
+        for control in device.get("controls", []):
+            control_type = control.get("type", "")
+            href = control.get("href", "")
+            if control_type.startswith("urn:x-nmos:control:sr-ctrl/") and "/connection/" in href:
+                version = control_type.rsplit("/", 1)[-1]
+                if versions["connection"] is None or version_key(version) > version_key(versions["connection"]):
+                    versions["connection"] = version
+                    node_url = href.split("/connection/")[0]
+
+        if not node_url and node.get("href"):
+            node_url = node["href"].rstrip('/') + "/x-nmos"
+
+        return node_url, versions
+
+    def node_for(self, device_id):
+        device = self.devices.get(device_id, {})
+        node = self.nodes.get(device.get("node_id"), {})
+        node_url, versions = self.node_endpoint(device, node)
+        name = node.get("label") or node.get("hostname") or device.get("label") or "Unknown"
+        return resources.node_info(name, node_url, versions)
+
+    def annotate(self, item, kind):
+        return resources.from_payload(item, kind, self.node_for(item.get("device_id")))
+
+    def sync(self):
+        print(f"[REGISTRY] Full sync from {self.query_url}")
+        started = time.monotonic()
+        begin_discovery_progress("registry", len(SUBSCRIBED_RESOURCES))
+        try:
+            fetched = {}
+            for resource in SUBSCRIBED_RESOURCES:
+                fetched[resource] = self.fetch_all(resource)
+                step_discovery_progress()
+        except Exception as e:
+            finish_discovery_progress(str(e))
+            raise
+
+        nodes = {n["id"]: n for n in fetched["nodes"]}
+        devices = {d["id"]: d for d in fetched["devices"]}
+        senders = fetched["senders"]
+        receivers = fetched["receivers"]
+
+        with self.lock:
+            self.nodes = nodes
+            self.devices = devices
+            diff = resource_store.replace_all(
+                [self.annotate(r, "receivers") for r in receivers if r.get("id")],
+                [self.annotate(s, "sources") for s in senders if s.get("id")]
+            )
+        if diff:
+            schedule_snapshot_save(0)
+        finish_discovery_progress()
+        print(f"[REGISTRY] Sync done: {len(nodes)} nodes, {len(receivers)} receivers, {len(senders)} senders in {time.monotonic() - started:.2f}s")
+
+    def reannotate(self):
+        changed = False
+        for kind in resource_store.KINDS:
+            items = []
+            for resource in resource_store.all_resources(kind):
+                node = self.node_for(resource.device_id)
+                if node is not resource.node:
+                    items.append(resource.with_node(node))
+            changed = bool(resource_store.apply_changes(kind, items)) or changed
+        return changed
+
+    def apply_grain(self, message):
+        if isinstance(message, (str, bytes)):
+            message = json.loads(message)
+        if not isinstance(message, dict) or message.get("grain_type") != "event":
+            return
+
+        grain = message.get("grain", {})
+        topic = grain.get("topic", "").strip("/")
+        events = [e for e in grain.get("data", []) if isinstance(e, dict) and e.get("path")]
+
+        with self.lock:
+            if topic in ("nodes", "devices"):
+                target = self.nodes if topic == "nodes" else self.devices
+                changed = False
+                for event in events:
+                    post = event.get("post")
+                    if post:
+                        changed = changed or target.get(event["path"]) != post
+                        target[event["path"]] = post
+                    elif target.pop(event["path"], None) is not None:
+                        changed = True
+                if changed and self.reannotate():
+                    schedule_snapshot_save()
+                return
+
+            kind = RESOURCE_KINDS.get(topic)
+            if not kind:
+                return
+
+            upserts, removals = [], []
+            for event in events:
+                pre, post = event.get("pre"), event.get("post")
+                if not post:
+                    removals.append(event["path"])
+                    print(f"[REGISTRY] Removed {topic[:-1]} {event['path']}")
+                elif pre != post or resource_store.get(kind, post.get("id")) is None:
+                    upserts.append(self.annotate(post, kind))
+                    print(f"[REGISTRY] {'Added' if not pre else 'Updated'} {topic[:-1]} {post.get('label', event['path'])}")
+
+            if resource_store.apply_changes(kind, upserts, removals):
+                schedule_snapshot_save()
+
+    def lookup(self, kind, resource_id):
+        resource = 'senders' if kind == 'sources' else 'receivers'
+        r = http_client.get(f"{self.query_url}{resource}/{resource_id}")
+        if r.status_code != 200:
+            return None
+        item = r.json()
+
+        with self.lock:
+            device_id = item.get("device_id")
+            if device_id and device_id not in self.devices:
+                d = http_client.get(f"{self.query_url}devices/{device_id}")
+                if d.status_code == 200:
+                    self.devices[device_id] = d.json()
+            node_id = self.devices.get(device_id, {}).get("node_id")
+            if node_id and node_id not in self.nodes:
+                n = http_client.get(f"{self.query_url}nodes/{node_id}")
+                if n.status_code == 200:
+                    self.nodes[node_id] = n.json()
+            return self.annotate(item, kind)
+
+    def subscribe(self, resource):
+        body = {
+            "max_update_rate_ms": 100,
+            "resource_path": f"/{resource}",
+            "params": {},
+            "persist": False,
+            "secure": False
+        }
+        r = http_client.post(f"{self.query_url}subscriptions", json=body)
+        r.raise_for_status()
+        return r.json()["ws_href"]
+
+    def open_socket(self, resource):
+        import websocket
+
+        ws_href = self.subscribe(resource)
+        print(f"[REGISTRY] Subscribed to /{resource} on {ws_href}")
+
+        def on_message(ws, message):
+            try:
+                self.apply_grain(message)
+            except Exception as e:
+                print(f"[REGISTRY] Failed to apply /{resource} event: {e}")
+
+        def on_error(ws, error):
+            print(f"[REGISTRY] WebSocket error on /{resource}: {error}")
+
+        app = websocket.WebSocketApp(ws_href, on_message=on_message, on_error=on_error)
+        thread = threading.Thread(target=app.run_forever, kwargs={"ping_interval": 30}, daemon=True)
+        thread.start()
+        return app, thread
+
+    def run(self):
+        try:
+            import websocket  # noqa: F401
+        except ImportError:
+            print("[REGISTRY] websocket-client is not installed, polling the registry instead")
+            self.poll()
+            return
+
+        backoff = 1
+        while not self.stopped:
+            try:
+                self.sync()
+                # One at a time, so sockets already open are closed below if a later subscribe() fails
+                for resource in SUBSCRIBED_RESOURCES:
+                    self.sockets.append(self.open_socket(resource))
+                backoff = 1
+                while not self.stopped and all(thread.is_alive() for _, thread in self.sockets):
+                    time.sleep(1)
+                if not self.stopped:
+                    print("[REGISTRY] Subscription lost, resyncing")
+            except Exception as e:
+                print(f"[REGISTRY] Registry unavailable: {e}")
+            finally:
+                for app, _ in self.sockets:
+                    app.close()
+                self.sockets = []
+
+            if not self.stopped:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+    def poll(self):
+        from services.cache import get_refresh_interval
+        while not self.stopped:
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"[REGISTRY] Registry unavailable: {e}")
+            time.sleep(get_refresh_interval())
+
+    def stop(self):
+        self.stopped = True
+        for app, _ in self.sockets:
+            app.close()
+
+def get_registry_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            from routes.settings import load_settings
+            registry_url = load_settings().get("registry_url")
+            if not registry_url:
+                raise ValueError("discovery_mode is 'registry' but no registry_url is set")
+            _client = RegistryClient(registry_url)
+        return _client
+
+def start_registry_watcher():
+    client = get_registry_client()
+    thread = threading.Thread(target=client.run, daemon=True)
+    thread.start()
+    print(f"[REGISTRY] Watching {client.query_url}")
+    return client
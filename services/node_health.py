@@ -0,0 +1,123 @@
+# /services/node_health.py
+# by Arnaud Cresp - 2025
+
+import threading
+import time
+from urllib.parse import urlparse
+
+# Per-node circuit breaker, keyed by host:port, fed by both discovery and takes.
+# closed: requests go through. open: requests fail at once until the reset delay.
+# half_open: one trial request decides whether the node is back.
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_breakers = {}
+_lock = threading.Lock()
+
+class NodeUnavailable(Exception):
+    pass
+
+def node_key(url):
+    return urlparse(url or "").netloc or url
+
+def get_limits():
+    from routes.settings import get_settings
+    settings = get_settings()
+    return (
+        max(1, int(settings.get("breaker_failures", 3))),
+        max(0.5, float(settings.get("breaker_reset", 10)))
+    )
+
+def _breaker(key):
+    breaker = _breakers.get(key)
+    if breaker is None:
+        breaker = _breakers[key] = {
+            "state": CLOSED,
+            "failures": 0,
+            "opened": None,
+            "trial": False,
+            "reason": ""
+        }
+    return breaker
+
+def _open(key, breaker, reason):
+    if breaker["state"] != OPEN:
+        print(f"[HEALTH] {key} marked down ({reason}), failing fast")
+    breaker["state"] = OPEN
+    breaker["opened"] = time.monotonic()
+    breaker["trial"] = False
+    breaker["reason"] = reason
+
+def _admit(url):
+    # (allowed, trial): whether a request may go out now, and whether it is the half-open trial
+    _, reset = get_limits()
+    key = node_key(url)
+    with _lock:
+        breaker = _breaker(key)
+        if breaker["state"] == CLOSED:
+            return True, False
+        if breaker["state"] == OPEN and time.monotonic() - breaker["opened"] >= reset:
+            breaker["state"] = HALF_OPEN
+            breaker["trial"] = False
+        if breaker["state"] == HALF_OPEN and not breaker["trial"]:
+            breaker["trial"] = True
+            return True, True
+        return False, False
+
+def allow(url):
+    # True when a request to this node may go out now
+    return _admit(url)[0]
+
+def _unavailable(url):
+    with _lock:
+        reason = _breaker(node_key(url))["reason"]
+    return NodeUnavailable(f"Node {node_key(url)} unavailable ({reason or 'circuit open'})")
+
+def check(url):
+    # Returns True when this request is the half-open trial
+    allowed, trial = _admit(url)
+    if not allowed:
+        raise _unavailable(url)
+    return trial
+
+def recheck(url, trial):
+    # For a request that passed check() and then waited: fail if the breaker opened meanwhile
+    with _lock:
+        state = _breaker(node_key(url))["state"]
+    if state != CLOSED and not (trial and state == HALF_OPEN):
+        raise _unavailable(url)
+
+def record_success(url):
+    key = node_key(url)
+    with _lock:
+        breaker = _breaker(key)
+        if breaker["state"] != CLOSED:
+            print(f"[HEALTH] {key} is back")
+        breaker.update(state=CLOSED, failures=0, opened=None, trial=False, reason="")
+
+def record_failure(url, reason="request failed"):
+    threshold, _ = get_limits()
+    key = node_key(url)
+    with _lock:
+        breaker = _breaker(key)
+        breaker["failures"] += 1
+        if breaker["state"] == HALF_OPEN or breaker["failures"] >= threshold:
+            _open(key, breaker, reason)
+
+def release_trial(url):
+    # The trial request ended without telling whether the node is back, let the next one try
+    with _lock:
+        breaker = _breakers.get(node_key(url))
+        if breaker and breaker["state"] == HALF_OPEN:
+            breaker["trial"] = False
+
+def mark_up(url):
+    record_success(url)
+
+def get_states():
+    with _lock:
+        return {
+            key: {"state": b["state"], "failures": b["failures"], "reason": b["reason"]}
+            for key, b in _breakers.items()
+        }
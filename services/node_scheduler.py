@@ -0,0 +1,238 @@
+# /services/node_scheduler.py
+# by Arnaud Cresp - 2025
+
+import os
+import random
+import threading
+import time
+import concurrent.futures
+from services import http_client, resource_store, resources, node_health
+from services.data_loader import load_nodes, NODES_FILE
+from services.nmos_discovery import fetch_node_data, build_api_url, resolve_node_versions
+from services.cache import node_host, schedule_snapshot_save, get_discovery_limits
+
+_scheduler = None
+
+class NodeScheduler:
+    def __init__(self):
+        self.states = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.executor = None
+        self.host_slots = {}
+        self.nodes_mtime = None
+        self.last_reload = 0
+
+    def load_settings(self):
+        from routes.settings import load_settings
+        settings = load_settings()
+        self.base_interval = max(10, int(settings.get("refresh_interval", 300)))
+        self.min_interval = max(1, min(self.base_interval, int(settings.get("refresh_min_interval", 10))))
+        self.max_backoff = max(self.base_interval, int(settings.get("refresh_max_backoff", 1800)))
+        self.liveness_interval = max(1, int(settings.get("liveness_interval", 30)))
+        self.liveness_timeout = float(settings.get("liveness_timeout", 1))
+        self.max_workers, self.per_host = get_discovery_limits()
+
+    def reload(self):
+        self.load_settings()
+        try:
+            self.nodes_mtime = os.path.getmtime(NODES_FILE)
+        except OSError:
+            self.nodes_mtime = None
+        self.last_reload = time.monotonic()
+
+        nodes = [n for n in load_nodes() if isinstance(n, dict) and n.get('url')]
+        now = time.monotonic()
+
+        with self.lock:
+            known = set()
+            for node in nodes:
+                key = node['url'].rstrip('/')
+                known.add(key)
+                self.host_slots.setdefault(node_host(node), threading.BoundedSemaphore(self.per_host))
+                state = self.states.get(key)
+                if state:
+                    state["node"] = node
+                    state["name"] = node.get('name') or key
+                    continue
+
+                seeded = bool(resource_store.by_node("receivers", key) or resource_store.by_node("sources", key))
+                self.states[key] = {
+                    "node": node,
+                    "name": node.get('name') or key,
+                    "interval": self.base_interval,
+                    "next_poll": now + random.uniform(0.5, 1.0) * self.base_interval if seeded else now,
+                    "next_probe": now + random.uniform(0, 1.0) * self.liveness_interval,
+                    "probe_interval": self.liveness_interval,
+                    "failures": 0,
+                    "alive": None,
+                    "busy": False,
+                    "last_poll": None,
+                    "last_change": None
+                }
+
+            for key in list(self.states):
+                if key not in known:
+                    del self.states[key]
+
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def needs_reload(self):
+        if time.monotonic() - self.last_reload > 30:
+            return True
+        try:
+            return os.path.getmtime(NODES_FILE) != self.nodes_mtime
+        except OSError:
+            return self.nodes_mtime is not None
+
+    def next_time(self, interval):
+        return time.monotonic() + interval * random.uniform(0.9, 1.1)
+
+    def mark_failed(self, state, reason, unreachable=True):
+        state["failures"] += 1
+        state["alive"] = False
+        state["interval"] = min(self.base_interval * 2 ** (state["failures"] - 1), self.max_backoff)
+        state["next_poll"] = self.next_time(state["interval"])
+        if unreachable:
+            # HTTP error statuses from the Node API say nothing about the Connection API
+            node_health.record_failure(state["node"]["url"], reason)
+        print(f"[SCHEDULER] {state['name']} unreachable ({reason}), next full poll in {state['interval']}s")
+
+    def poll_node(self, key):
+        state = self.states.get(key)
+        if not state:
+            return
+        node = state["node"]
+        try:
+            with self.host_slots[node_host(node)]:
+                node_data = fetch_node_data(node)
+            state["last_poll"] = time.time()
+
+            if node_data.get("errors"):
+                self.mark_failed(state, "; ".join(node_data["errors"]), node_data.get("unreachable"))
+                return
+
+            receivers = node_data.get("receivers", [])
+            sources = node_data.get("sources", [])
+
+            if resources.payload_fingerprint(receivers + sources) != resource_store.node_fingerprint(key):
+                receivers = resources.from_payloads(receivers, "receivers", node_data["node"])
+                sources = resources.from_payloads(sources, "sources", node_data["node"])
+                if resource_store.replace_node(key, receivers, sources):
+                    schedule_snapshot_save()
+                state["interval"] = self.min_interval
+                state["last_change"] = time.time()
+                print(f"[SCHEDULER] {state['name']} changed: {len(receivers)} receivers, {len(sources)} sources, next poll in {state['interval']}s")
+            else:
+                receivers = resource_store.by_node("receivers", key)
+                sources = resource_store.by_node("sources", key)
+                if any(r.node != node_data["node"] for r in receivers + sources):
+                    # Name or versions edited in nodes.json, payloads unchanged
+                    receivers = resources.rebind(receivers, node_data["node"])
+                    sources = resources.rebind(sources, node_data["node"])
+                    if resource_store.replace_node(key, receivers, sources):
+                        schedule_snapshot_save()
+                state["interval"] = min(state["interval"] * 2, self.base_interval)
+
+            if state["alive"] is False:
+                print(f"[SCHEDULER] {state['name']} is back online")
+            node_health.mark_up(node["url"])
+            state["failures"] = 0
+            state["alive"] = True
+            state["next_poll"] = self.next_time(state["interval"])
+            state["probe_interval"] = self.liveness_interval
+            state["next_probe"] = time.monotonic() + self.liveness_interval
+        except Exception as e:
+            self.mark_failed(state, str(e), isinstance(e, http_client.TRANSPORT_ERRORS))
+        finally:
+            state["busy"] = False
+            self.wakeup.set()
+
+    def probe_node(self, key):
+        state = self.states.get(key)
+        if not state:
+            return
+        node = state["node"]
+        try:
+            nmos_version = resolve_node_versions(node).get('nmos') or 'v1.3'
+            url = build_api_url(node['url'], 'node', nmos_version, 'self/')
+            unreachable = False
+            try:
+                alive = http_client.get(url, timeout=self.liveness_timeout).status_code == 200
+            except Exception as e:
+                alive = False
+                unreachable = isinstance(e, http_client.TRANSPORT_ERRORS)
+
+            if alive and state["alive"] is False:
+                print(f"[SCHEDULER] {state['name']} answered liveness probe, polling now")
+                node_health.mark_up(node["url"])
+                state["next_poll"] = time.monotonic()
+            elif not alive and state["alive"] is not False:
+                self.mark_failed(state, "liveness probe failed", unreachable)
+        finally:
+            if state["alive"] is False:
+                # A node that stays down is probed less and less often, like its full polls
+                state["probe_interval"] = min(state["probe_interval"] * 2, self.max_backoff)
+            else:
+                state["probe_interval"] = self.liveness_interval
+            state["next_probe"] = self.next_time(state["probe_interval"])
+            state["busy"] = False
+            self.wakeup.set()
+
+    def run(self):
+        self.reload()
+        print(f"[SCHEDULER] Adaptive refresh started for {len(self.states)} nodes (idle {self.base_interval}s, active {self.min_interval}s, liveness {self.liveness_interval}s)")
+        while not self.stopped:
+            if self.needs_reload():
+                self.reload()
+
+            now = time.monotonic()
+            next_due = now + 5
+            with self.lock:
+                for key, state in self.states.items():
+                    if state["busy"]:
+                        continue
+                    if state["next_poll"] <= now:
+                        state["busy"] = True
+                        self.executor.submit(self.poll_node, key)
+                    elif state["next_probe"] <= now:
+                        state["busy"] = True
+                        self.executor.submit(self.probe_node, key)
+                    else:
+                        next_due = min(next_due, state["next_poll"], state["next_probe"])
+
+            self.wakeup.wait(max(0.05, next_due - time.monotonic()))
+            self.wakeup.clear()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+
+    def get_node_states(self):
+        now = time.monotonic()
+        with self.lock:
+            return {
+                state["name"]: {
+                    "alive": state["alive"],
+                    "failures": state["failures"],
+                    "interval": state["interval"],
+                    "probe_interval": state["probe_interval"],
+                    "next_poll_in": round(max(0, state["next_poll"] - now), 1),
+                    "last_poll": state["last_poll"],
+                    "last_change": state["last_change"]
+                }
+                for state in self.states.values()
+            }
+
+def get_scheduler():
+    return _scheduler
+
+def start_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = NodeScheduler()
+        thread = threading.Thread(target=_scheduler.run, daemon=True)
+        thread.start()
+    return _scheduler
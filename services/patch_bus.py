@@ -2,50 +2,75 @@
 # by Arnaud Cresp - 2025
 
 import asyncio
+from services import patch_queue
 
-async def emit_patch(sender_id, receiver_id, origin="external"):
-    print(f"[PATCH] {origin}: {receiver_id} ← {sender_id}")
+ESSENCES = ["video", "audio", "data"]
+
+def plan_legs(routes):
+    # routes: [(logical source, logical destination)], one result dict per route
+    patched = []
+    pairs = []
+    legs = []
+    for src, dst in routes:
+        result = {}
+        for essence in ESSENCES:
+            sender = (src or {}).get(essence)
+            receiver = (dst or {}).get(essence)
+            if sender and receiver:
+                legs.append((result, essence, sender, receiver))
+                pairs.append((receiver, sender))
+            else:
+                result[essence] = {
+                    "status": "skipped",
+                    "reason": "missing sender or receiver"
+                }
+        patched.append(result)
+    return patched, legs, pairs
+
+def fill_legs(legs, outcomes):
+    for (result, essence, sender, receiver), outcome in zip(legs, outcomes):
+        result[essence] = {
+            "status": outcome.get("status"),
+            "sender": sender,
+            "receiver": receiver,
+            "message": outcome.get("message", "")
+        }
+        if "duration_ms" in outcome:
+            result[essence]["duration_ms"] = outcome["duration_ms"]
+        if "confirmed" in outcome:
+            result[essence]["activation_time"] = outcome["activation_time"]
+            result[essence]["confirmed"] = outcome["confirmed"]
+
+def patch_logical_groups(routes):
+    # Blocking version for Flask handlers, all legs go through the patch queue together
+    patched, legs, pairs = plan_legs(routes)
+    try:
+        outcomes = [future.result() for future in patch_queue.submit(pairs)]
+    except Exception as e:
+        outcomes = [{"status": "error", "message": str(e)}] * len(pairs)
+    fill_legs(legs, outcomes)
+    return patched
+
+async def patch_logical_groups_async(routes):
+    # Same from a running event loop (BMD), waits without holding a thread
+    patched, legs, pairs = plan_legs(routes)
+    try:
+        futures = [asyncio.wrap_future(future) for future in patch_queue.submit(pairs)]
+        outcomes = await asyncio.gather(*futures)
+    except Exception as e:
+        outcomes = [{"status": "error", "message": str(e)}] * len(pairs)
+    fill_legs(legs, outcomes)
+    return patched
 
+async def emit_patches(routes, origin="external"):
+    # routes: [(logical sender id, logical receiver id)]
     from services.logical import get_logical_pair
-    from services.data_loader import load_nodes
-    from services.nmos_connection import change_source
-
-    src, dst = get_logical_pair(sender_id, receiver_id)
-    result = {}
-
-    nodes = load_nodes()
-
-    async def patch_one(essence, sender, receiver):
-        try:
-            patch_result = await asyncio.to_thread(change_source, nodes, receiver, sender)
-            return (essence, {
-                "status": patch_result.get("status"),
-                "sender": sender,
-                "receiver": receiver,
-                "message": patch_result.get("message", "")
-            })
-        except Exception as e:
-            return (essence, {
-                "status": "error",
-                "sender": sender,
-                "receiver": receiver,
-                "message": str(e)
-            })
-
-    tasks = []
-    for essence in ["video", "audio", "data"]:
-        s = src.get(essence)
-        d = dst.get(essence)
-        if s and d:
-            tasks.append(patch_one(essence, s, d))
-        else:
-            result[essence] = {
-                "status": "skipped",
-                "reason": "missing sender or receiver"
-            }
-
-    results = await asyncio.gather(*tasks)
-    for essence, data in results:
-        result[essence] = data
-
-    return result
+
+    for sender_id, receiver_id in routes:
+        print(f"[PATCH] {origin}: {receiver_id} ← {sender_id}")
+
+    pairs = [get_logical_pair(sender_id, receiver_id) for sender_id, receiver_id in routes]
+    return await patch_logical_groups_async(pairs)
+
+async def emit_patch(sender_id, receiver_id, origin="external"):
+    return (await emit_patches([(sender_id, receiver_id)], origin))[0]
@@ -0,0 +1,163 @@
+# /services/patch_engine.py
+# by Arnaud Cresp - 2025
+
+import asyncio
+import random
+import threading
+from urllib.parse import urlparse
+import aiohttp
+from services import node_health
+
+# Connection API traffic for takes runs on one asyncio loop in its own thread.
+# BMD, REST and the Web UI hand coroutines to it with submit() / run().
+_loop = None
+_session = None
+_node_slots = {}
+_start_lock = threading.Lock()
+
+# Failures where the node never answered, these count against its circuit breaker
+TRANSPORT_ERRORS = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+
+class Response:
+    # Just what the take code reads from a reply, same names as requests
+    def __init__(self, status_code, text, data):
+        self.status_code = status_code
+        self.text = text
+        self._data = data
+
+    def json(self):
+        if isinstance(self._data, Exception):
+            raise self._data
+        return self._data
+
+def _run_loop(loop, ready):
+    asyncio.set_event_loop(loop)
+    loop.call_soon(ready.set)
+    loop.run_forever()
+
+def get_loop():
+    global _loop
+    if _loop is None:
+        with _start_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+                threading.Thread(target=_run_loop, args=(loop, ready), name="patch-engine", daemon=True).start()
+                ready.wait()
+                _loop = loop
+                print("[ENGINE] Patch engine loop started")
+    return _loop
+
+def submit(coro):
+    # Thread-safe, returns a concurrent.futures.Future. Cancelling it cancels the coroutine
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+def run(coro, timeout=None):
+    # Blocking helper for sync callers, never call it from the engine loop itself
+    future = submit(coro)
+    try:
+        return future.result(timeout)
+    except TimeoutError:
+        future.cancel()
+        raise
+
+def get_timeouts():
+    from routes.settings import load_settings
+    settings = load_settings()
+    return float(settings.get("http_connect_timeout", 2)), float(settings.get("http_timeout", 3))
+
+async def get_session():
+    global _session
+    if _session is None or _session.closed:
+        from routes.settings import load_settings
+        settings = load_settings()
+        connect, read = get_timeouts()
+        connector = aiohttp.TCPConnector(
+            limit=int(settings.get("http_pool_connections", 512)),
+            limit_per_host=int(settings.get("http_pool_maxsize", 4))
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read, total=connect + read)
+        )
+    return _session
+
+def node_slot(url):
+    # Caps concurrent connection requests per node across every take in flight
+    key = urlparse(url).netloc
+    slot = _node_slots.get(key)
+    if slot is None:
+        from routes.settings import load_settings
+        per_node = max(1, int(load_settings().get("patch_per_node", 4)))
+        slot = _node_slots[key] = asyncio.Semaphore(per_node)
+    return slot
+
+async def request(method, url, **kwargs):
+    # Raises node_health.NodeUnavailable at once when the node's breaker is open
+    trial = node_health.check(url)
+    answered = None
+    try:
+        session = await get_session()
+        async with node_slot(url):
+            # Legs queued behind the slot re-check, the breaker may have opened while they waited
+            node_health.recheck(url, trial)
+            async with session.request(method, url, **kwargs) as r:
+                text = await r.text()
+                try:
+                    data = await r.json(content_type=None)
+                except Exception as e:
+                    data = e
+        answered = True
+    except TRANSPORT_ERRORS as e:
+        answered = False
+        node_health.record_failure(url, str(e) or "timeout")
+        raise
+    finally:
+        if answered is None and trial:
+            # Cancelled or failed some other way, a half-open trial must not stay claimed
+            node_health.release_trial(url)
+    node_health.record_success(url)
+    return Response(r.status, text, data)
+
+async def request_with_retry(method, url, **kwargs):
+    # Only for idempotent calls (staged PATCHes): transport failures are retried with jitter
+    from routes.settings import get_settings
+    retries = max(0, int(get_settings().get("patch_retries", 2)))
+    for attempt in range(retries + 1):
+        try:
+            return await request(method, url, **kwargs)
+        except TRANSPORT_ERRORS:
+            if attempt == retries:
+                raise
+        await asyncio.sleep(0.05 * 2 ** attempt * random.uniform(0.5, 1.5))
+
+async def get(url, **kwargs):
+    return await request("GET", url, **kwargs)
+
+async def patch(url, **kwargs):
+    return await request("PATCH", url, **kwargs)
+
+async def post(url, **kwargs):
+    return await request("POST", url, **kwargs)
+
+async def _close():
+    global _session
+    tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+def stop():
+    global _loop
+    if _loop is None:
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(_close(), _loop).result(2)
+    except Exception:
+        pass
+    _loop.call_soon_threadsafe(_loop.stop)
+    _loop = None
+    print("[ENGINE] Patch engine stopped")
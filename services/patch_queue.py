@@ -0,0 +1,133 @@
+# /services/patch_queue.py
+# by Arnaud Cresp - 2025
+
+import asyncio
+import threading
+import concurrent.futures
+from services import patch_engine
+
+# Per receiver: at most one patch on its way to the node and one waiting behind it.
+# A newer target for the same receiver replaces the waiting one (last write wins).
+_lock = threading.Lock()
+_inflight = {}
+_pending = {}
+stats = {"submitted": 0, "sent": 0, "coalesced": 0}
+
+def new_entry(sender_id, future):
+    return {"sender_id": sender_id, "waiters": [future], "superseded": []}
+
+def replace_target(entry, sender_id, future):
+    if entry["sender_id"] == sender_id:
+        entry["waiters"].append(future)
+    else:
+        entry["superseded"].extend(entry["waiters"])
+        entry["sender_id"] = sender_id
+        entry["waiters"] = [future]
+    stats["coalesced"] += 1
+
+def submit(pairs):
+    # pairs: [(receiver_id, sender_id or None to disconnect)], one Future per pair.
+    # Thread-safe, the batch itself runs on the patch engine loop
+    futures = []
+    starting = {}
+    with _lock:
+        for receiver_id, sender_id in pairs:
+            future = concurrent.futures.Future()
+            futures.append(future)
+            stats["submitted"] += 1
+
+            inflight = _inflight.get(receiver_id)
+            if inflight is None:
+                _inflight[receiver_id] = new_entry(sender_id, future)
+                starting[receiver_id] = True
+            elif receiver_id in starting:
+                # Not sent yet, the later pair of this call wins
+                replace_target(inflight, sender_id, future)
+            elif inflight["sender_id"] == sender_id:
+                # Same target already on its way, wait for it instead of sending it again.
+                # A different target waiting behind it is dropped, this take is newer
+                pending = _pending.pop(receiver_id, None)
+                if pending:
+                    inflight["superseded"].extend(pending["waiters"] + pending["superseded"])
+                inflight["waiters"].append(future)
+                stats["coalesced"] += 1
+            elif receiver_id in _pending:
+                replace_target(_pending[receiver_id], sender_id, future)
+            else:
+                _pending[receiver_id] = new_entry(sender_id, future)
+
+        batch = [(receiver_id, _inflight[receiver_id]["sender_id"]) for receiver_id in starting]
+
+    if batch:
+        patch_engine.submit(run(batch))
+    return futures
+
+async def execute(batch):
+    from services.nmos_connection import change_sources_async, disconnect_receivers_async
+
+    # nodes.json is only read, off the loop, when a resource is missing from the store
+    nodes = None
+    takes = [(r, s) for r, s in batch if s is not None]
+    drops = [r for r, s in batch if s is None]
+    outcomes = {}
+    try:
+        taken, dropped = await asyncio.gather(
+            change_sources_async(nodes, takes) if takes else asyncio.sleep(0, []),
+            disconnect_receivers_async(nodes, drops) if drops else asyncio.sleep(0, [])
+        )
+        for (receiver_id, _), outcome in zip(takes, taken):
+            outcomes[receiver_id] = outcome
+        for receiver_id, outcome in zip(drops, dropped):
+            outcomes[receiver_id] = outcome
+    except Exception as e:
+        print(f"[QUEUE] Patch batch failed: {e}")
+        for receiver_id, _ in batch:
+            outcomes.setdefault(receiver_id, {"status": "error", "message": str(e)})
+    return outcomes
+
+def resolve(entry, outcome):
+    for future in entry["waiters"]:
+        future.set_result(dict(outcome))
+    for future in entry["superseded"]:
+        future.set_result({
+            "status": "superseded",
+            "message": "Replaced by a newer take before it was sent",
+            "code": 409,
+            "final": outcome
+        })
+
+def settle(batch, outcomes, cancelled=False):
+    # Answers the finished batch and returns the pending targets that go next
+    done = []
+    next_batch = []
+    with _lock:
+        for receiver_id, _ in batch:
+            done.append((_inflight.pop(receiver_id), outcomes[receiver_id]))
+            pending = _pending.pop(receiver_id, None)
+            if pending and cancelled:
+                done.append((pending, outcomes[receiver_id]))
+            elif pending:
+                _inflight[receiver_id] = pending
+                next_batch.append((receiver_id, pending["sender_id"]))
+
+    for entry, outcome in done:
+        resolve(entry, outcome)
+    return next_batch
+
+async def run(batch):
+    while batch:
+        stats["sent"] += len(batch)
+        try:
+            outcomes = await execute(batch)
+        except asyncio.CancelledError:
+            # Engine shutting down, callers still get an answer
+            settle(batch, {r: {"status": "error", "message": "Cancelled"} for r, _ in batch}, cancelled=True)
+            raise
+
+        batch = settle(batch, outcomes)
+        if batch:
+            print(f"[QUEUE] Sending {len(batch)} coalesced patch(es)")
+
+def queue_state():
+    with _lock:
+        return {"inflight": len(_inflight), "pending": len(_pending), **stats}
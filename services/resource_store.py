@@ -0,0 +1,176 @@
+# /services/resource_store.py
+# by Arnaud Cresp - 2025
+
+import threading
+from collections import deque
+from services.resources import Resource
+
+KINDS = ("receivers", "sources")
+CHANGE_TYPES = ("added", "removed", "modified")
+
+_lock = threading.RLock()
+_loaded = False
+_generation = 0
+_history = deque(maxlen=200)
+_listeners = []
+
+def _build_snapshot(receivers, sources, generation=0):
+    snapshot = {"generation": generation, "by_id": {}, "by_node": {}, "by_type": {}}
+    for kind, items in (("receivers", receivers), ("sources", sources)):
+        items = [i for i in items if isinstance(i, Resource) and i.id]
+        by_id = {}
+        by_node = {}
+        by_type = {}
+        for item in items:
+            by_id[item.id] = item
+            by_node.setdefault(item.node_url, []).append(item)
+            by_type.setdefault(item.type or "unknown", []).append(item)
+        snapshot[kind] = items
+        snapshot["by_id"][kind] = by_id
+        snapshot["by_node"][kind] = by_node
+        snapshot["by_type"][kind] = by_type
+    return snapshot
+
+_snapshot = _build_snapshot([], [])
+
+def fingerprint(resources):
+    return frozenset((r.id, r.version) for r in resources)
+
+def node_fingerprint(node_url):
+    return fingerprint(by_node("receivers", node_url) + by_node("sources", node_url))
+
+def _diff(old_snapshot, items):
+    diff = {}
+    for kind in KINDS:
+        old = old_snapshot["by_id"][kind]
+        new = {i.id: i for i in items[kind] if isinstance(i, Resource) and i.id}
+        diff[kind] = {
+            "added": [i for i in new if i not in old],
+            "removed": [i for i in old if i not in new],
+            "modified": [i for i, item in new.items() if i in old and old[i] is not item and old[i] != item]
+        }
+    return diff
+
+def has_changes(diff):
+    return any(diff[kind][change] for kind in KINDS for change in CHANGE_TYPES)
+
+def _commit(update):
+    global _snapshot, _generation
+    ensure_loaded()
+    with _lock:
+        items = update(_snapshot)
+        diff = _diff(_snapshot, items)
+        if not has_changes(diff):
+            return None
+        _generation += 1
+        _snapshot = _build_snapshot(items["receivers"], items["sources"], _generation)
+        diff["generation"] = _generation
+        _history.append(diff)
+        listeners = list(_listeners)
+
+    for callback in listeners:
+        try:
+            callback(diff)
+        except Exception as e:
+            print(f"[ERROR] Resource store listener failed: {e}")
+    return diff
+
+def replace_all(receivers, sources):
+    return _commit(lambda snapshot: {"receivers": receivers, "sources": sources})
+
+def ensure_loaded():
+    global _snapshot, _loaded, _generation
+    if _loaded:
+        return
+    from services.cache import load_cache_snapshot, schedule_snapshot_save
+    cache = load_cache_snapshot()
+    snapshot = _build_snapshot(cache.get("receivers", []), cache.get("sources", []), cache.get("generation", 0))
+    with _lock:
+        if not _loaded:
+            _snapshot = snapshot
+            _generation = snapshot["generation"]
+            _loaded = True
+    if cache.get("migrated"):
+        schedule_snapshot_save(0)
+
+def current():
+    ensure_loaded()
+    return _snapshot
+
+def generation():
+    return current()["generation"]
+
+def get(kind, resource_id):
+    return current()["by_id"][kind].get(resource_id)
+
+def all_resources(kind):
+    return current()[kind]
+
+def by_node(kind, node_url):
+    return current()["by_node"][kind].get(node_url, [])
+
+def by_type(kind, resource_type):
+    return current()["by_type"][kind].get(resource_type, [])
+
+def apply_changes(kind, upserts=(), removals=()):
+    upserts = list(upserts)
+    changed_ids = {r.id for r in upserts} | set(removals)
+    if not changed_ids:
+        return None
+
+    def update(snapshot):
+        items = {k: snapshot[k] for k in KINDS}
+        items[kind] = [i for i in items[kind] if i.id not in changed_ids] + upserts
+        return items
+
+    return _commit(update)
+
+def replace_node(node_url, receivers, sources):
+    def update(snapshot):
+        items = {k: [i for i in snapshot[k] if i.node_url != node_url] for k in KINDS}
+        items["receivers"].extend(receivers)
+        items["sources"].extend(sources)
+        return items
+
+    return _commit(update)
+
+def put(kind, resource):
+    return apply_changes(kind, [resource])
+
+def subscribe(callback):
+    with _lock:
+        _listeners.append(callback)
+
+def unsubscribe(callback):
+    with _lock:
+        if callback in _listeners:
+            _listeners.remove(callback)
+
+def changes_since(since):
+    with _lock:
+        current_generation = _generation
+        entries = [d for d in _history if d["generation"] > since]
+
+    empty = {kind: {change: [] for change in CHANGE_TYPES} for kind in KINDS}
+    if since >= current_generation:
+        return {"generation": current_generation, "changes": empty}
+    if since < 0 or not entries or entries[0]["generation"] != since + 1:
+        return {"generation": current_generation, "full_reload": True}
+
+    changes = {}
+    for kind in KINDS:
+        state = {}
+        for diff in entries:
+            for resource_id in diff[kind]["added"]:
+                state[resource_id] = "modified" if state.get(resource_id) == "removed" else "added"
+            for resource_id in diff[kind]["removed"]:
+                if state.get(resource_id) == "added":
+                    del state[resource_id]
+                else:
+                    state[resource_id] = "removed"
+            for resource_id in diff[kind]["modified"]:
+                if state.get(resource_id) != "added":
+                    state[resource_id] = "modified"
+        changes[kind] = {change: [i for i, c in state.items() if c == change] for change in CHANGE_TYPES}
+
+    return {"generation": current_generation, "changes": changes}
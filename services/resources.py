@@ -0,0 +1,183 @@
+# /services/resources.py
+# by Arnaud Cresp - 2025
+
+import threading
+
+SNAPSHOT_SCHEMA = 3
+PACKED_FIELDS = ("label", "type", "version", "device_id", "grouphint", "sender_id", "active")
+
+_nodes = {}
+_nodes_lock = threading.Lock()
+
+class NodeInfo:
+    __slots__ = ("name", "url", "versions")
+
+    def __init__(self, name, url, versions):
+        self.name = name
+        self.url = url
+        self.versions = versions
+
+    def __eq__(self, other):
+        if not isinstance(other, NodeInfo):
+            return NotImplemented
+        return (self.name, self.url, self.versions) == (other.name, other.url, other.versions)
+
+    def __hash__(self):
+        return hash((self.name, self.url))
+
+    def to_dict(self):
+        return {"name": self.name, "url": self.url, "versions": dict(self.versions)}
+
+def node_info(name, url, versions=None):
+    # Every resource of a node points at the same NodeInfo instead of its own copy
+    versions = {k: v for k, v in (versions or {}).items()}
+    key = (name, url, tuple(sorted(versions.items(), key=lambda kv: kv[0])))
+    with _nodes_lock:
+        node = _nodes.get(key)
+        if node is None:
+            node = _nodes[key] = NodeInfo(name, url, versions)
+        return node
+
+class Resource:
+    __slots__ = ("id", "kind", "label", "type", "version", "device_id", "grouphint", "sender_id", "active", "node")
+
+    def __init__(self, id, kind, label="", type="unknown", version=None, device_id=None,
+                 grouphint="", sender_id=None, active=None, node=None):
+        self.id = id
+        self.kind = kind
+        self.label = label
+        self.type = type
+        self.version = version
+        self.device_id = device_id
+        self.grouphint = grouphint
+        self.sender_id = sender_id
+        self.active = active
+        self.node = node
+
+    @property
+    def node_name(self):
+        return self.node.name if self.node else None
+
+    @property
+    def node_url(self):
+        return self.node.url if self.node else None
+
+    @property
+    def versions(self):
+        return self.node.versions if self.node else {}
+
+    def fields(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        if not isinstance(other, Resource):
+            return NotImplemented
+        return self.fields() == other.fields()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Resource({self.kind}, {self.id}, {self.label!r}, {self.node_name!r})"
+
+    def with_node(self, node):
+        values = dict(zip(self.__slots__, self.fields()))
+        values["node"] = node
+        return Resource(**values)
+
+    def to_dict(self):
+        data = {
+            "id": self.id,
+            "label": self.label,
+            "type": self.type,
+            "version": self.version,
+            "node_name": self.node_name,
+            "node_url": self.node_url,
+            "versions": dict(self.versions)
+        }
+        if self.grouphint:
+            data["grouphint"] = self.grouphint
+        if self.kind == "receivers":
+            data["subscription"] = {"sender_id": self.sender_id, "active": self.active}
+        elif self.active is not None:
+            data["subscription"] = {"active": self.active}
+        return data
+
+def extract_grouphint(tags):
+    for key, values in (tags or {}).items():
+        if "grouphint" not in key or not isinstance(values, list):
+            continue
+        for value in values:
+            if isinstance(value, str) and "[" in value:
+                return value
+    return ""
+
+def from_payload(item, kind, node):
+    from services.nmos_discovery import get_resource_type
+
+    subscription = item.get("subscription") or {}
+    return Resource(
+        id=item["id"],
+        kind=kind,
+        label=item.get("label") or "",
+        type=get_resource_type(item),
+        version=item.get("version"),
+        device_id=item.get("device_id"),
+        grouphint=extract_grouphint(item.get("tags")),
+        sender_id=subscription.get("sender_id"),
+        active=subscription.get("active"),
+        node=node
+    )
+
+def from_payloads(items, kind, node):
+    return [from_payload(item, kind, node) for item in items if isinstance(item, dict) and item.get("id")]
+
+def rebind(items, node):
+    # Unchanged payloads still follow name or versions edits made in nodes.json
+    return [r if r.node == node else r.with_node(node) for r in items]
+
+def payload_fingerprint(items):
+    return frozenset((i.get("id"), i.get("version")) for i in items if isinstance(i, dict))
+
+def to_snapshot(receivers, sources, generation=0):
+    nodes = []
+    node_index = {}
+
+    def pack(resource):
+        index = node_index.get(id(resource.node))
+        if index is None:
+            index = node_index[id(resource.node)] = len(nodes)
+            nodes.append((resource.node.name, resource.node.url, dict(resource.node.versions)) if resource.node else None)
+        return (resource.id,) + tuple(getattr(resource, name) for name in PACKED_FIELDS) + (index,)
+
+    return {
+        "schema": SNAPSHOT_SCHEMA,
+        "generation": generation,
+        "receivers": tuple(pack(r) for r in receivers),
+        "sources": tuple(pack(s) for s in sources),
+        "nodes": tuple(nodes)
+    }
+
+def from_snapshot(data):
+    if not isinstance(data, dict):
+        return {"receivers": [], "sources": [], "generation": 0}
+
+    if data.get("schema") == 2:
+        # Compact JSON cache: nodes were written as dicts
+        data = dict(data, nodes=[(n["name"], n["url"], n["versions"]) if n else None for n in data.get("nodes", [])])
+    elif data.get("schema") != SNAPSHOT_SCHEMA:
+        # Legacy cache: raw IS-04 payloads carrying their own node metadata
+        result = {}
+        for kind in ("receivers", "sources"):
+            result[kind] = [
+                from_payload(item, kind, node_info(item.get("node_name"), item.get("node_url"), item.get("versions")))
+                for item in data.get(kind, [])
+                if isinstance(item, dict) and item.get("id")
+            ]
+        result["generation"] = 0
+        return result
+
+    nodes = [node_info(*n) if n else None for n in data.get("nodes", ())]
+    result = {"generation": data.get("generation", 0)}
+    for kind in ("receivers", "sources"):
+        result[kind] = [Resource(row[0], kind, *row[1:-1], node=nodes[row[-1]]) for row in data.get(kind, ())]
+    return result
@@ -0,0 +1,101 @@
+# /services/salvos.py
+# by Arnaud Cresp - 2025
+
+import json
+import time
+from pathlib import Path
+from services.logical import load_logical_ids
+
+SALVOS_FILE = Path("data_salvos.json")
+
+# {"<salvo name>": {"id": 1, "routes": [{"src": <logical source id>, "dest": <logical receiver id>}, ...]}}
+
+def load_salvos():
+    if SALVOS_FILE.exists():
+        with open(SALVOS_FILE, "r") as f:
+            return json.load(f)
+    return {}
+
+def save_salvos(data):
+    with open(SALVOS_FILE, "w") as f:
+        json.dump(data, f, indent=2)
+
+def find_salvo(salvo_id=None, name=None):
+    salvos = load_salvos()
+    if name is not None:
+        return (name, salvos[name]) if name in salvos else (None, None)
+    for salvo_name, salvo in salvos.items():
+        if str(salvo.get("id")) == str(salvo_id):
+            return salvo_name, salvo
+    return None, None
+
+def salvo_ids():
+    # Salvo IDs in recall order, the BMD salvo output uses the position in this list
+    return sorted(s["id"] for s in load_salvos().values() if "id" in s)
+
+def patch_code(patched):
+    return "".join(
+        "1" if patched.get(essence, {}).get("status") in ["success", "patched"] else "0"
+        for essence in ["video", "audio", "data"]
+    )
+
+def plan_salvo(salvo):
+    # One read of data_logical.json for the whole salvo
+    logical = load_logical_ids()
+    sources = {v.get("id"): (k, v) for k, v in logical.get("sources", {}).items()}
+    receivers = {v.get("id"): (k, v) for k, v in logical.get("receivers", {}).items()}
+
+    legs = []
+    for route in salvo.get("routes", []):
+        src_id, dest_id = route.get("src"), route.get("dest")
+        src_name, src = sources.get(src_id, (None, None))
+        dest_name, dest = receivers.get(dest_id, (None, None))
+        legs.append({
+            "src_id": src_id,
+            "dest_id": dest_id,
+            "source_name": src_name,
+            "destination_name": dest_name,
+            "route": (src, dest) if src and dest else None
+        })
+    return legs
+
+def collect_results(legs, patched_all, started):
+    patched_all = iter(patched_all)
+    results = []
+    for leg in legs:
+        result = {k: leg[k] for k in ("src_id", "dest_id", "source_name", "destination_name")}
+        if leg["route"] is None:
+            result.update(status="error", message="Invalid src or dest ID")
+        else:
+            patched = next(patched_all)
+            result.update(status="ok", patch_code=patch_code(patched), patched=patched)
+        results.append(result)
+    return {
+        "duration_ms": round((time.monotonic() - started) * 1000, 1),
+        "results": results
+    }
+
+def recall_salvo(salvo):
+    # Blocking, every leg of the salvo goes out as one batch
+    from services.patch_bus import patch_logical_groups
+
+    started = time.monotonic()
+    legs = plan_salvo(salvo)
+    patched_all = patch_logical_groups([leg["route"] for leg in legs if leg["route"]])
+    return collect_results(legs, patched_all, started)
+
+async def recall_salvo_async(salvo):
+    from services.patch_bus import patch_logical_groups_async
+
+    started = time.monotonic()
+    legs = plan_salvo(salvo)
+    patched_all = await patch_logical_groups_async([leg["route"] for leg in legs if leg["route"]])
+    return collect_results(legs, patched_all, started)
+
+def applied_routes(outcome):
+    # (logical source id, logical receiver id) for every leg where at least one essence was patched
+    return [
+        (r["src_id"], r["dest_id"])
+        for r in outcome["results"]
+        if r.get("patch_code", "000") != "000"
+    ]
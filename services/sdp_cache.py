@@ -0,0 +1,59 @@
+# /services/sdp_cache.py
+# by Arnaud Cresp - 2025
+
+import threading
+import time
+from services import resource_store
+from utils.sdp_filter import remove_secondary_streams
+
+_entries = {}
+_lock = threading.Lock()
+_patch_secondary = None
+stats = {"hits": 0, "misses": 0}
+
+def get_ttl():
+    from routes.settings import get_settings
+    return float(get_settings().get("sdp_cache_ttl", 300))
+
+def lookup(sender, patch_secondary):
+    # Cached transport file for this sender, or None when it has to be fetched
+    global _patch_secondary
+    with _lock:
+        if _patch_secondary is not None and _patch_secondary != patch_secondary:
+            print("[SDP] patch_secondary changed, clearing SDP cache")
+            _entries.clear()
+        _patch_secondary = patch_secondary
+        entry = _entries.get(sender.id)
+
+    if entry is None or entry["version"] != sender.version or time.monotonic() - entry["fetched"] > get_ttl():
+        stats["misses"] += 1
+        return None
+    stats["hits"] += 1
+    return select(entry, patch_secondary)
+
+def remember(sender, raw, patch_secondary):
+    entry = {"version": sender.version, "fetched": time.monotonic(), "raw": raw, "filtered": None}
+    with _lock:
+        _entries[sender.id] = entry
+    return select(entry, patch_secondary)
+
+def select(entry, patch_secondary):
+    if patch_secondary:
+        return entry["raw"]
+    if entry["filtered"] is None:
+        entry["filtered"] = remove_secondary_streams(entry["raw"])
+    return entry["filtered"]
+
+def on_store_change(diff):
+    stale = diff["sources"]["modified"] + diff["sources"]["removed"]
+    if not stale:
+        return
+    with _lock:
+        for sender_id in stale:
+            _entries.pop(sender_id, None)
+
+def cache_state():
+    with _lock:
+        return {"entries": len(_entries), **stats}
+
+resource_store.subscribe(on_store_change)
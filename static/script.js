@@ -10,6 +10,7 @@ function toggleList(button) {
 
 let selectedSourceId = localStorage.getItem('selectedSourceId') || "";
 let selectedReceiverId = localStorage.getItem('selectedReceiverId') || "";
+let cacheGeneration = typeof initialCacheGeneration !== 'undefined' ? initialCacheGeneration : -1;
 
 document.addEventListener('DOMContentLoaded', () => {
     if (selectedSourceId) {
@@ -130,4 +131,33 @@ function disconnectReceiver() {
         msgEl.innerText = 'An error occurred while disconnecting the receiver.';
         msgEl.style.color = 'red';
     });
-}
\ No newline at end of file
+}
+
+function pollCacheChanges() {
+    fetch(`/cache_changes?since=${cacheGeneration}`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.status !== 'success' || data.generation === cacheGeneration) {
+                return;
+            }
+            cacheGeneration = data.generation;
+
+            const changes = data.changes || {};
+            const receivers = changes.receivers || {};
+            const sources = changes.sources || {};
+            const listChanged = ['added', 'removed'].some(k => (receivers[k] || []).length || (sources[k] || []).length);
+
+            if (data.full_reload || listChanged) {
+                const msgEl = document.getElementById('success-message');
+                msgEl.innerText = 'Discovery updated: reload the page to see new or removed resources';
+                msgEl.style.color = 'gray';
+            }
+
+            if (selectedReceiverId && (data.full_reload || (receivers.modified || []).includes(selectedReceiverId))) {
+                fetchCurrentSender(selectedReceiverId);
+            }
+        })
+        .catch(() => {});
+}
+
+setInterval(pollCacheChanges, 10000);